@@ -0,0 +1,250 @@
+import argparse
+import array
+import csv
+import datetime
+import mmap
+import os
+import sqlite3
+import sys
+
+from arpav_sinks import CsvSink
+from arpav_table_cells import parse_cell_value, parse_date
+
+SERIES_FIELDNAMES = ['station_name', 'pollutant', 'meas_info', 'meas_unit', 'city_name']
+
+
+class SeriesValues:
+    """
+    The values of a series (a station/pollutant/meas_info/meas_unit column of a province) returned by a query:
+    "dates" is a list of datetime.date and "values" an array('d') of the same length, with NaN for the cells
+    that are not numbers (e.g. "-").
+    """
+
+    __slots__ = SERIES_FIELDNAMES + ['dates', 'values']
+
+    def __init__(self, station_name, pollutant, meas_info, meas_unit, city_name, dates, values):
+        self.station_name = station_name
+        self.pollutant = pollutant
+        self.meas_info = meas_info
+        self.meas_unit = meas_unit
+        self.city_name = city_name
+        self.dates = dates
+        self.values = values
+
+    def __repr__(self):
+        return (f"SeriesValues({', '.join(f'{field}={getattr(self, field)!r}' for field in SERIES_FIELDNAMES)}, "
+                f"{len(self.values)} values)")
+
+
+def _iter_csv_records(file_bytes):
+    """
+    Yield (offset, length, record) for every CSV record of the file after the header. A record is usually a line,
+    but a quoted field can contain new lines, so a line with an odd number of quotes is joined with the next ones.
+    """
+    offset = 0
+    record_start = None
+    quotes = 0
+    for line in file_bytes.splitlines(keepends=True):
+        if record_start is None:
+            record_start, quotes = offset, 0
+        quotes += line.count(b'"')
+        offset += len(line)
+        if quotes % 2 == 0:
+            yield record_start, offset - record_start, file_bytes[record_start:offset]
+            record_start = None
+
+
+class ArchiveIndex:
+    """
+    Index of the monthly CSV files of the archive (see CsvSink), stored in an sqlite file next to them.
+    For every series and month it keeps the byte offsets and lengths of the rows of the series in the monthly
+    file, and their day of the month, so that a query reads only those rows (through a memory map of the file)
+    instead of parsing every file.
+    The index is updated incrementally: "update()" indexes again only the monthly files whose size or
+    modification time changed, and "update_month()" can be called after a month is written (see DataArchive).
+    """
+
+    index_file_name = "arpav_index.sqlite"
+
+    def __init__(self, arpav_archives_dir, index_path=None):
+        self.arpav_archives_dir = arpav_archives_dir
+        self.csv_sink = CsvSink(arpav_archives_dir)
+        self.index_path = index_path if index_path is not None else os.path.join(arpav_archives_dir,
+                                                                                 self.index_file_name)
+        self._connection = sqlite3.connect(self.index_path)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS files (year INTEGER, month INTEGER, size INTEGER, "
+                                     "mtime_ns INTEGER, PRIMARY KEY (year, month))")
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS series (series_id INTEGER PRIMARY KEY, "
+                                     f"{', '.join(SERIES_FIELDNAMES)}, UNIQUE ({', '.join(SERIES_FIELDNAMES)}))")
+            # offsets and lengths (arrays 'q') and days of the month (array 'b') of the rows
+            self._connection.execute("CREATE TABLE IF NOT EXISTS slices (series_id INTEGER, year INTEGER, "
+                                     "month INTEGER, offsets BLOB, lengths BLOB, days BLOB, "
+                                     "PRIMARY KEY (series_id, year, month))")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS slices_month ON slices (year, month)")
+
+    def archived_months(self):
+        """ Return the sorted (year, month) of the monthly CSV files of the archive """
+        months = []
+        for year in os.listdir(self.arpav_archives_dir):
+            year_dir = os.path.join(self.arpav_archives_dir, year)
+            if not (year.isdigit() and os.path.isdir(year_dir)):
+                continue
+            for month in os.listdir(year_dir):
+                if month.isdigit() and os.path.exists(self.csv_sink.monthly_file_path(int(year), int(month))):
+                    months.append((int(year), int(month)))
+        return sorted(months)
+
+    def update(self):
+        """ Index the monthly files that are new or changed since the last update. Return the number of them """
+        indexed_months = {(year, month): (size, mtime_ns) for year, month, size, mtime_ns
+                          in self._connection.execute("SELECT year, month, size, mtime_ns FROM files")}
+        archived_months = self.archived_months()
+        updated_months = 0
+        for year, month in archived_months:
+            stat = os.stat(self.csv_sink.monthly_file_path(year, month))
+            if indexed_months.get((year, month)) != (stat.st_size, stat.st_mtime_ns):
+                self.update_month(year, month)
+                updated_months += 1
+        # The months whose file was deleted
+        for year, month in set(indexed_months) - set(archived_months):
+            with self._connection:
+                self._remove_month(year, month)
+        return updated_months
+
+    def _remove_month(self, year, month):
+        self._connection.execute("DELETE FROM slices WHERE year = ? AND month = ?", (year, month))
+        self._connection.execute("DELETE FROM files WHERE year = ? AND month = ?", (year, month))
+
+    def _series_id(self, series_key):
+        self._connection.execute(f"INSERT OR IGNORE INTO series ({', '.join(SERIES_FIELDNAMES)}) "
+                                 f"VALUES ({', '.join('?' for _ in SERIES_FIELDNAMES)})", series_key)
+        return self._connection.execute(f"SELECT series_id FROM series WHERE "
+                                        f"{' AND '.join(f'{field} = ?' for field in SERIES_FIELDNAMES)}",
+                                        series_key).fetchone()[0]
+
+    def update_month(self, year, month):
+        """ Index (again) the monthly file of year/month """
+        monthly_file_path = self.csv_sink.monthly_file_path(year, month)
+        stat = os.stat(monthly_file_path)
+        with open(monthly_file_path, mode="rb") as csv_file:
+            file_bytes = csv_file.read()
+
+        header_length = file_bytes.find(b"\n") + 1
+        fieldnames = next(csv.reader([file_bytes[:header_length].decode()]))
+        series_columns = [fieldnames.index(field) for field in SERIES_FIELDNAMES]
+        date_column = fieldnames.index('date')
+        month_slices = {}
+        for offset, length, record in _iter_csv_records(file_bytes[header_length:]):
+            row = next(csv.reader([record.decode()]), None)
+            if not row:
+                continue
+            offsets, lengths, days = month_slices.setdefault(tuple(row[column] for column in series_columns),
+                                                             (array.array('q'), array.array('q'), array.array('b')))
+            offsets.append(header_length + offset)
+            lengths.append(length)
+            days.append(int(row[date_column][8:10]))
+
+        with self._connection:
+            self._remove_month(year, month)
+            self._connection.executemany(
+                "INSERT INTO slices VALUES (?, ?, ?, ?, ?, ?)",
+                [(self._series_id(series_key), year, month, offsets.tobytes(), lengths.tobytes(), days.tobytes())
+                 for series_key, (offsets, lengths, days) in month_slices.items()])
+            self._connection.execute("INSERT INTO files VALUES (?, ?, ?, ?)",
+                                     (year, month, stat.st_size, stat.st_mtime_ns))
+
+    def series(self, **filters):
+        """ Return the (series_id, station_name, pollutant, meas_info, meas_unit, city_name) matching the filters """
+        unknown_filters = set(filters) - set(SERIES_FIELDNAMES)
+        if unknown_filters:
+            raise ValueError(f"Unknown series filters: {sorted(unknown_filters)}")
+        filters = {field: value for field, value in filters.items() if value is not None}
+        where = " AND ".join(f"{field} = ?" for field in filters) or "1"
+        return self._connection.execute(f"SELECT series_id, {', '.join(SERIES_FIELDNAMES)} FROM series "
+                                        f"WHERE {where} ORDER BY {', '.join(SERIES_FIELDNAMES)}",
+                                        list(filters.values())).fetchall()
+
+    def query(self, station_name=None, pollutant=None, meas_info=None, meas_unit=None, city_name=None,
+              start_date=None, end_date=None, refresh=True):
+        """
+        Return a SeriesValues for every series matching the given fields (None matches everything), with the
+        values from start_date to end_date (excluded) in date order. Only the rows of those series in the
+        monthly files of those months are read.
+        With refresh, the monthly files changed since the last update are indexed first, so that the offsets
+        are never stale.
+        """
+        if refresh:
+            self.update()
+        start_date = parse_date(start_date) if start_date is not None else datetime.date.min
+        end_date = parse_date(end_date) if end_date is not None else datetime.date.max
+        matching_series = self.series(station_name=station_name, pollutant=pollutant, meas_info=meas_info,
+                                      meas_unit=meas_unit, city_name=city_name)
+        series_values = {series_id: SeriesValues(*series_key, dates=[], values=array.array('d'))
+                         for series_id, *series_key in matching_series}
+        if not series_values:
+            return []
+
+        slices_by_month = {}
+        for year, month, series_id, offsets, lengths, days in self._connection.execute(
+                f"SELECT year, month, series_id, offsets, lengths, days FROM slices "
+                f"WHERE series_id IN ({', '.join('?' for _ in series_values)}) "
+                f"AND year * 100 + month BETWEEN ? AND ? ORDER BY year, month",
+                list(series_values) + [start_date.year * 100 + start_date.month,
+                                       end_date.year * 100 + end_date.month]):
+            slices_by_month.setdefault((year, month), []).append((series_id, offsets, lengths, days))
+
+        for (year, month), month_slices in slices_by_month.items():
+            self._read_month_slices(year, month, month_slices, series_values, start_date, end_date)
+        return list(series_values.values())
+
+    def _read_month_slices(self, year, month, month_slices, series_values, start_date, end_date):
+        with open(self.csv_sink.monthly_file_path(year, month), mode="rb") as csv_file:
+            fieldnames = next(csv.reader([csv_file.readline().decode()]))
+            value_column = fieldnames.index('cell_value')
+            with mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+                for series_id, offsets, lengths, days in month_slices:
+                    offsets, lengths, days = (array.array('q', offsets), array.array('q', lengths),
+                                              array.array('b', days))
+                    values = series_values[series_id]
+                    for offset, length, day in zip(offsets, lengths, days):
+                        date = datetime.date(year, month, day)
+                        if not start_date <= date < end_date:
+                            continue
+                        row = next(csv.reader([file_map[offset:offset + length].decode()]))
+                        values.dates.append(date)
+                        values.values.append(parse_cell_value(row[value_column])[0])
+
+    def close(self):
+        self._connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the monthly CSV files of the archive and query a series")
+    parser.add_argument("archives_dir")
+    parser.add_argument("--station", default=None)
+    parser.add_argument("--pollutant", default=None)
+    parser.add_argument("--meas-info", default=None)
+    parser.add_argument("--meas-unit", default=None)
+    parser.add_argument("--province", default=None)
+    parser.add_argument("--start", default=None, help="First day (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Day after the last one (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    archive_index = ArchiveIndex(args.archives_dir)
+    print(f"Indexed {archive_index.update()} monthly files", file=sys.stderr)
+    if any(value is not None for value in (args.station, args.pollutant, args.meas_info, args.meas_unit,
+                                           args.province)):
+        writer = csv.writer(sys.stdout)
+        writer.writerow(SERIES_FIELDNAMES + ['date', 'value'])
+        for values in archive_index.query(station_name=args.station, pollutant=args.pollutant,
+                                          meas_info=args.meas_info, meas_unit=args.meas_unit,
+                                          city_name=args.province, start_date=args.start, end_date=args.end):
+            series_key = [getattr(values, field) for field in SERIES_FIELDNAMES]
+            for date, value in zip(values.dates, values.values):
+                writer.writerow(series_key + [date.isoformat(), value])
+    archive_index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import datetime
+import os
+
+from arpav_metrics import ScrapeMetrics
+from arpav_schema_cache import HeaderSchemaCache
+from arpav_table_cells import TABLE_CELL_FIELDNAMES
+from arpav_web_scraper import ArpavArchiveScraper, DataArchive
+
+BACKENDS = ("http", "selenium", "replay")
+
+
+def _parse_date(text):
+    return datetime.datetime.strptime(text, "%Y-%m-%d")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Scrape the validated air quality data of the ARPAV archive")
+    parser.add_argument("archives_dir", help="Directory of the monthly archive (and of its manifest)")
+    parser.add_argument("--backend", choices=BACKENDS, default="http",
+                        help="http: POST requests (default), selenium: pool of headless browsers, "
+                             "replay: only the pages stored in --cache-dir, without network")
+    parser.add_argument("--start", type=_parse_date, default=None,
+                        help="First day to scrape (YYYY-MM-DD, default: yesterday)")
+    parser.add_argument("--end", type=_parse_date, default=None,
+                        help="Day after the last one to scrape (YYYY-MM-DD, default: the day after --start)")
+    parser.add_argument("--last-days", type=int, default=None,
+                        help="Scrape the N days before today (instead of --start and --end)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Download again the days already archived and rewrite only the revised ones "
+                             "(http backend, e.g. a nightly --refresh --last-days 90)")
+    parser.add_argument("--provinces", nargs="+", default=["Belluno"])
+    parser.add_argument("--format", choices=("csv", "parquet", "sqlite", "matrix"), default="csv")
+    parser.add_argument("--index", action="store_true",
+                        help="Keep the query index of the CSV files up to date (see arpav_archive_index.py)")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel requests (or browsers with selenium)")
+    parser.add_argument("--rate", type=float, default=None, help="Maximum number of requests per second")
+    parser.add_argument("--url", default=None, help="Archive URL (e.g. of a local arpav_stub_server.py)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Store the raw pages here (http backend, required by replay)")
+    parser.add_argument("--cache-max-mb", type=float, default=None, help="Size limit of the page cache")
+    parser.add_argument("--max-pages-per-driver", type=int, default=200,
+                        help="Pages loaded by a browser before it is restarted (selenium)")
+    parser.add_argument("--show-browser", action="store_true", help="Do not run the browsers headless (selenium)")
+    parser.add_argument("--log-file", default=None,
+                        help="Append a JSON line for every day scraped and every progress readout to this file")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Keep the stage histograms and counters in this file (Prometheus text format)")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="Seconds between the throughput/ETA readouts")
+    return parser
+
+
+def open_response_cache(args):
+    """ Return the ResponseCache of --cache-dir (None without it). It is closed by the caller """
+    if args.cache_dir is None:
+        return None
+    from arpav_response_cache import ResponseCache
+    max_size_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb is not None else None
+    return ResponseCache(args.cache_dir, max_size_bytes=max_size_bytes)
+
+
+def build_scraper(args, metrics=None, response_cache=None):
+    """
+    Return the scraper of the chosen backend. The heavy dependencies (requests, selenium) are imported and the
+    browsers are started only by the backend that needs them.
+    """
+    # The table layouts found in the archive are logged next to it
+    os.makedirs(args.archives_dir, exist_ok=True)
+    schema_cache = HeaderSchemaCache(log_path=os.path.join(args.archives_dir, "arpav_schema_versions.jsonl"))
+
+    if args.backend == "http":
+        return ArpavArchiveScraper(arpav_air_data_archive_url=args.url, response_cache=response_cache,
+                                   schema_cache=schema_cache, metrics=metrics)
+    elif args.backend == "replay":
+        return ArpavArchiveScraper(response_cache=response_cache, replay=True, schema_cache=schema_cache,
+                                   metrics=metrics)
+    else:
+        from arpav_driver_pool import DriverPool
+        return DriverPool(size=args.workers, max_pages_per_driver=args.max_pages_per_driver,
+                          headless=not args.show_browser, schema_cache=schema_cache, metrics=metrics)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    if args.last_days is not None:
+        starting_date, ending_date = today - datetime.timedelta(days=args.last_days), today
+    else:
+        starting_date = args.start if args.start is not None else today - datetime.timedelta(days=1)
+        ending_date = args.end if args.end is not None else starting_date + datetime.timedelta(days=1)
+    if args.refresh and args.backend != "http":
+        raise SystemExit("The archive can only be refreshed with the http backend")
+    if args.backend == "replay" and args.cache_dir is None:
+        raise SystemExit("The replay backend needs --cache-dir")
+    if args.backend == "selenium" and args.cache_dir is not None:
+        raise SystemExit("The pages loaded by the browsers are not cached, --cache-dir needs the http backend")
+
+    metrics = ScrapeMetrics(log_path=args.log_file, metrics_path=args.metrics_file,
+                            progress_interval=args.progress_interval)
+    response_cache = open_response_cache(args)
+    arpav_scraper, data_archive = None, None
+    try:
+        arpav_scraper = build_scraper(args, metrics=metrics, response_cache=response_cache)
+        data_archive = DataArchive(fieldnames=TABLE_CELL_FIELDNAMES, arpav_archives_dir=args.archives_dir,
+                                   output_format=args.format, build_index=args.index)
+        scrape = data_archive.refresh_archived_data if args.refresh else data_archive.scrape_and_archive_data
+        scrape(starting_date=starting_date, ending_date=ending_date, city_names=args.provinces,
+               max_workers=args.workers, max_requests_per_second=args.rate, arpav_scraper=arpav_scraper,
+               metrics=metrics)
+    finally:
+        if data_archive is not None:
+            data_archive.close()
+        if arpav_scraper is not None:
+            # The DriverPool quits its browsers and the HTTP scraper closes the connections of its session
+            arpav_scraper.close()
+        if response_cache is not None:
+            response_cache.close()
+
+
+if __name__ == "__main__":
+    main()
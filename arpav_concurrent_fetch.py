@@ -0,0 +1,89 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """
+    Global rate limit shared by all the workers: the requests are spaced so that there are at most
+    max_requests_per_second of them (None means no limit).
+    """
+
+    def __init__(self, max_requests_per_second=None):
+        self.min_interval = 1.0 / max_requests_per_second if max_requests_per_second else 0.0
+        self._next_request_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.min_interval == 0.0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            request_time = max(now, self._next_request_time)
+            self._next_request_time = request_time + self.min_interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+class ConcurrentFetcher:
+    """
+    Fetch the bulletins of a date x province grid with a pool of threads.
+    fetch_day is a function like "ArpavArchiveScraper.retrieve_single_data_from_website", that receives
+    (city_name, date) and returns the TableCells of that day. The cells are collected by the worker thread, so the
+    table is also extracted in parallel.
+    The results are yielded in the same order of the grid (dates first, then provinces), while at most
+    max_pending requests are in progress or waiting to be consumed.
+    If stop_on_error is False, a day whose request raises an exception is yielded with cells None,
+    instead of stopping the whole fetch.
+    With collect_cells=False, whatever fetch_day returns is yielded as it is instead of the list of the cells.
+    """
+
+    def __init__(self, fetch_day, max_workers=4, max_requests_per_second=None, max_pending=None,
+                 stop_on_error=True, collect_cells=True):
+        self.fetch_day = fetch_day
+        self.stop_on_error = stop_on_error
+        self.collect_cells = collect_cells
+        self.max_workers = max_workers
+        self.max_pending = max_pending if max_pending is not None else 4 * max_workers
+        self.rate_limiter = RateLimiter(max_requests_per_second=max_requests_per_second)
+
+    def _fetch_single_day(self, city_name, date):
+        self.rate_limiter.wait()
+        try:
+            result = self.fetch_day(city_name=city_name, date=date)
+            return list(result) if self.collect_cells else result
+        except Exception as e:
+            if self.stop_on_error:
+                raise
+            print(f"ERROR: Unable to retrieve the data of {city_name} for the date {date}: {e!r}")
+            return None
+
+    def fetch(self, city_names, dates):
+        """
+        Yield a tuple (city_name, date, cells) for every date and province.
+        If a request raises an exception (and stop_on_error is True), the remaining requests are cancelled and
+        the exception is raised when its result would have been yielded.
+        """
+        return self.fetch_grid((city_name, date) for date in dates for city_name in city_names)
+
+    def fetch_grid(self, grid):
+        """ Same as "fetch", but for any iterable of (city_name, date) pairs (e.g. only the missing days) """
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for city_name, date in grid:
+                    pending.append((city_name, date, executor.submit(self._fetch_single_day, city_name, date)))
+                    if len(pending) >= self.max_pending:
+                        yield self._pop_result(pending)
+                while pending:
+                    yield self._pop_result(pending)
+            finally:
+                # Do not wait for the requests that nobody is going to consume
+                for _, _, future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _pop_result(pending):
+        city_name, date, future = pending.popleft()
+        return city_name, date, future.result()
@@ -0,0 +1,130 @@
+import contextlib
+import os
+import queue
+import threading
+
+from selenium.common.exceptions import WebDriverException
+
+from arpav_metrics import ScrapeMetrics
+from arpav_schema_cache import HeaderSchemaCache
+from arpav_scraper_with_selenium import ArpavArchiveScraper
+
+
+class DriverPool:
+    """
+    Pool of Selenium scrapers, each one with its own headless browser, that are reused among the days.
+    Every browser is a separate process, so with one worker thread per scraper (e.g. a ConcurrentFetcher with
+    max_workers=pool.size) the pages are loaded in parallel on different CPU cores.
+    The browsers are started only when needed (at most "size" of them), checked before every use and replaced
+    after max_pages_per_driver pages or when they crash.
+    """
+
+    def __init__(self, size=None, max_pages_per_driver=200, headless=True, scraper_factory=None, schema_cache=None,
+                 metrics=None):
+        self.size = size if size is not None else (os.cpu_count() or 1)
+        self.max_pages_per_driver = max_pages_per_driver
+        self.schema_cache = schema_cache if schema_cache is not None else HeaderSchemaCache()
+        # Shared by all the browsers, like the schema cache
+        self.metrics = metrics if metrics is not None else ScrapeMetrics()
+        if scraper_factory is None:
+            def scraper_factory():
+                return ArpavArchiveScraper(headless=headless, schema_cache=self.schema_cache, metrics=self.metrics)
+        self.scraper_factory = scraper_factory
+        self._idle_scrapers = queue.Queue()
+        # Pages loaded by every scraper (by id) since its browser was started
+        self._pages_served = {}
+        self._created_scrapers = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _create_scraper(self):
+        try:
+            scraper = self.scraper_factory()
+        except Exception:
+            with self._lock:
+                self._created_scrapers -= 1
+            raise
+        with self._lock:
+            self._pages_served[id(scraper)] = 0
+        return scraper
+
+    def _discard_scraper(self, scraper, wake_waiting_thread=True):
+        with self._lock:
+            self._created_scrapers -= 1
+            self._pages_served.pop(id(scraper), None)
+        try:
+            scraper.quit()
+        except WebDriverException:
+            # The browser already crashed
+            pass
+        if wake_waiting_thread:
+            # A thread waiting for an idle scraper can now start a new browser instead
+            self._idle_scrapers.put(None)
+
+    @staticmethod
+    def _is_healthy(scraper):
+        try:
+            return scraper.driver.execute_script("return 1") == 1
+        except WebDriverException:
+            return False
+
+    def _checkout(self):
+        while True:
+            if self._closed:
+                raise RuntimeError("The driver pool is closed")
+            try:
+                scraper = self._idle_scrapers.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created_scrapers < self.size
+                    if can_create:
+                        self._created_scrapers += 1
+                if can_create:
+                    return self._create_scraper()
+                scraper = self._idle_scrapers.get()
+            if scraper is None:
+                continue
+
+            if self._is_healthy(scraper):
+                return scraper
+            print("WARNING: A browser of the pool is not responding, it is going to be replaced")
+            self._discard_scraper(scraper)
+
+    def _checkin(self, scraper, crashed=False):
+        with self._lock:
+            self._pages_served[id(scraper)] += 1
+            is_worn_out = self._pages_served[id(scraper)] >= self.max_pages_per_driver
+        if crashed or is_worn_out or self._closed:
+            self._discard_scraper(scraper)
+        else:
+            self._idle_scrapers.put(scraper)
+
+    @contextlib.contextmanager
+    def scraper(self):
+        """ Borrow a scraper of the pool: "with pool.scraper() as scraper: ..." """
+        scraper = self._checkout()
+        try:
+            yield scraper
+        except WebDriverException:
+            self._checkin(scraper, crashed=True)
+            raise
+        except BaseException:
+            self._checkin(scraper)
+            raise
+        else:
+            self._checkin(scraper)
+
+    def retrieve_single_data_from_website(self, city_name, date):
+        """ Same of ArpavArchiveScraper.retrieve_single_data_from_website, with one of the browsers of the pool """
+        with self.scraper() as scraper:
+            return scraper.retrieve_single_data_from_website(city_name=city_name, date=date)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                scraper = self._idle_scrapers.get_nowait()
+            except queue.Empty:
+                break
+            if scraper is not None:
+                self._discard_scraper(scraper, wake_waiting_thread=False)
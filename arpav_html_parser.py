@@ -0,0 +1,201 @@
+from html.parser import HTMLParser
+
+ARPAV_TABLE_DIV_ID = "ariadativalidati"
+
+
+class BulletinTableParser(HTMLParser):
+    """
+    This parser collects the rows of the table contained in the <div id='ariadativalidati'> of the ARPAV bulletin,
+    without the need of a browser.
+    Every cell is stored as a dict with its text, the text of its first link and of its first <strong> tag, and its
+    colspan/rowspan. The rows inside <thead>/<tfoot> are skipped, like the "tbody/tr" xpath used by the Selenium
+    scraper would do.
+    """
+
+    def __init__(self, div_id=ARPAV_TABLE_DIV_ID):
+        super().__init__(convert_charrefs=True)
+        self.div_id = div_id
+        self.rows = []
+        # Number of <div> opened since the div with the table (0 means we are outside of it)
+        self._div_depth = 0
+        # Number of <table> opened inside the div (the cells of nested tables are part of the outer cell text)
+        self._table_depth = 0
+        self._table_done = False
+        self._in_header_section = False
+        self._row = None
+        self._cell = None
+        # Tags whose text is being captured for the current cell ('a' and 'strong')
+        self._capturing = {}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._div_depth == 0:
+            if tag == "div" and attrs.get("id") == self.div_id:
+                self._div_depth = 1
+            return
+        if tag == "div":
+            self._div_depth += 1
+            return
+        if self._table_done:
+            return
+
+        if tag == "table":
+            self._table_depth += 1
+        elif self._table_depth != 1:
+            # Everything of a nested table only contributes to the text of the outer cell
+            if tag == "br" and self._cell is not None:
+                self._cell['parts'].append("\n")
+            return
+        elif tag in ("thead", "tfoot"):
+            self._in_header_section = True
+        elif tag == "tbody":
+            self._in_header_section = False
+        elif tag == "tr":
+            self._close_row()
+            if not self._in_header_section:
+                self._row = []
+        elif tag in ("td", "th"):
+            self._close_cell()
+            if self._row is not None:
+                self._cell = {'tag': tag,
+                              'parts': [],
+                              'colspan': self._span_value(attrs.get("colspan")),
+                              'rowspan': self._span_value(attrs.get("rowspan")),
+                              'link_text': None,
+                              'strong_text': None}
+        elif tag == "br" and self._cell is not None:
+            self._cell['parts'].append("\n")
+            for parts in self._capturing.values():
+                parts.append("\n")
+        elif tag in ("a", "strong") and self._cell is not None:
+            key = 'link_text' if tag == "a" else 'strong_text'
+            if self._cell[key] is None and tag not in self._capturing:
+                self._capturing[tag] = []
+
+    def handle_endtag(self, tag):
+        if self._div_depth == 0:
+            return
+        if tag == "div":
+            self._div_depth -= 1
+            return
+        if self._table_done:
+            return
+
+        if tag == "table":
+            self._table_depth -= 1
+            if self._table_depth == 0:
+                self._close_row()
+                self._table_done = True
+        elif self._table_depth != 1:
+            return
+        elif tag in ("thead", "tfoot"):
+            self._in_header_section = False
+        elif tag == "tr":
+            self._close_row()
+        elif tag in ("td", "th"):
+            self._close_cell()
+        elif tag in self._capturing:
+            key = 'link_text' if tag == "a" else 'strong_text'
+            self._cell[key] = _normalize_text("".join(self._capturing.pop(tag)))
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            # The new lines of the HTML source are whitespace: only <br> breaks a line of the rendered text
+            data = data.replace("\r", " ").replace("\n", " ")
+            self._cell['parts'].append(data)
+            for parts in self._capturing.values():
+                parts.append(data)
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+    def _close_cell(self):
+        if self._cell is None:
+            return
+        for tag, parts in self._capturing.items():
+            key = 'link_text' if tag == "a" else 'strong_text'
+            self._cell[key] = _normalize_text("".join(parts))
+        self._capturing = {}
+        self._cell['text'] = _normalize_text("".join(self._cell.pop('parts')))
+        self._row.append(self._cell)
+        self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    @staticmethod
+    def _span_value(value):
+        try:
+            return max(int(value), 1)
+        except (TypeError, ValueError):
+            return 1
+
+
+class BulletinTable:
+    """
+    Rows of the ARPAV bulletin table where every cell has also its column index 'x'.
+    The column index is computed from the colspan/rowspan structure of the table and it plays the same role of the
+    rendered x coordinate used by the Selenium scraper: the cells of the lower header rows belong to the upper cell
+    with the largest 'x' that is lower or equal to theirs.
+    If the rows already come with their 'x' (e.g. the rendered coordinates read from the browser),
+    compute_column_indexes can be set to False to keep them.
+    """
+
+    def __init__(self, rows, compute_column_indexes=True):
+        self.rows = rows
+        if compute_column_indexes:
+            self._set_column_indexes()
+        # Only the <td> cells are addressed by the extraction (like the xpath 'tbody/tr/td')
+        self._td_rows = [[cell for cell in row if cell['tag'] == "td"] for row in rows]
+
+    def _set_column_indexes(self):
+        # Columns that are already taken by a cell with rowspan > 1 of a previous row
+        occupied_cells = set()
+        for row_index, row in enumerate(self.rows):
+            column_index = 0
+            for cell in row:
+                while (row_index, column_index) in occupied_cells:
+                    column_index += 1
+                cell['x'] = column_index
+                for row_offset in range(1, cell['rowspan']):
+                    for col_offset in range(cell['colspan']):
+                        occupied_cells.add((row_index + row_offset, column_index + col_offset))
+                column_index += cell['colspan']
+
+    def row_cells(self, row_index):
+        """ Return the <td> cells of the row (like the xpath 'tbody/tr[row_index + 1]/td') """
+        try:
+            return self._td_rows[row_index]
+        except IndexError:
+            return []
+
+    def cell_text(self, row_index, cell_index):
+        try:
+            return self._td_rows[row_index][cell_index]['text']
+        except IndexError:
+            return ""
+
+    def station_names(self):
+        """ Return the text of the <strong> tag of the second cell of every row (xpath 'tbody/tr/td[2]/strong') """
+        station_names = []
+        for cells in self._td_rows:
+            if len(cells) > 1 and cells[1]['strong_text'] is not None:
+                station_names.append(cells[1]['strong_text'])
+        return station_names
+
+
+def parse_bulletin_table(html_text, div_id=ARPAV_TABLE_DIV_ID):
+    parser = BulletinTableParser(div_id=div_id)
+    parser.feed(html_text)
+    parser.close()
+    return BulletinTable(parser.rows)
+
+
+def _normalize_text(text):
+    # Mimic the rendered text returned by the browser: collapse the whitespaces and keep only explicit line breaks
+    lines = [" ".join(line.split()) for line in text.split("\n")]
+    return "\n".join(line for line in lines if line)
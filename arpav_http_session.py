@@ -0,0 +1,124 @@
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ArpavHttpSession:
+    """
+    HTTP client used by the scraper instead of the module-level "requests.post".
+    Every thread gets its own requests.Session, so the connections to ARPAV are kept alive and reused among the
+    days fetched by the same worker. The requests that fail with a connection error, a timeout, a 5xx status or
+    429 Too Many Requests are retried up to max_retries times, waiting an exponential backoff with full jitter
+    (random between 0 and backoff_factor * 2 ** attempt seconds, at most max_backoff), or the time asked by the
+    Retry-After header of the answer if there is one (also at most max_backoff).
+    The latency of every request attempt is recorded in "latencies" (seconds), and the retries are also counted
+    by the ScrapeMetrics (if any, see arpav_metrics.py).
+    """
+
+    retry_status_codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, timeout=(10, 60), max_retries=3, backoff_factor=1.0, max_backoff=60.0, pool_maxsize=4,
+                 metrics=None):
+        # timeout is the (connect, read) timeout in seconds, like in requests
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.pool_maxsize = pool_maxsize
+        self.latencies = []
+        self.retries = 0
+        self.metrics = metrics
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _backoff_time(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def _retry_after_time(self, response):
+        """ Return the seconds of the Retry-After header (delay or HTTP date), None if it is missing or invalid """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None:
+            return None
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                retry_date = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return None
+            if retry_date.tzinfo is None:
+                retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+            seconds = (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        return min(self.max_backoff, max(0.0, seconds))
+
+    def post(self, url, data, headers=None):
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            wait_time = None
+            start_time = time.monotonic()
+            try:
+                response = session.post(url, data=data, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record_attempt(time.monotonic() - start_time, is_retry=attempt > 0)
+                if attempt == self.max_retries:
+                    raise
+                print(f"WARNING: Request to {url} failed ({e}). Retrying ({attempt + 1}/{self.max_retries})")
+            else:
+                self._record_attempt(time.monotonic() - start_time, is_retry=attempt > 0)
+                if response.status_code not in self.retry_status_codes:
+                    return response
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                print(f"WARNING: Request to {url} returned {response.status_code}. "
+                      f"Retrying ({attempt + 1}/{self.max_retries})")
+                wait_time = self._retry_after_time(response)
+            time.sleep(wait_time if wait_time is not None else self._backoff_time(attempt))
+
+    def _record_attempt(self, latency, is_retry):
+        with self._lock:
+            self.latencies.append(latency)
+            if is_retry:
+                self.retries += 1
+        if is_retry and self.metrics is not None:
+            self.metrics.increment("retries")
+
+    def latency_summary(self):
+        """ Return a string with the number of requests, the retries and the latency percentiles """
+        with self._lock:
+            latencies = sorted(self.latencies)
+            retries = self.retries
+        if not latencies:
+            return "No requests sent"
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+        return (f"{len(latencies)} requests ({retries} retries): "
+                f"mean {sum(latencies) / len(latencies):.3f}s, p50 {percentile(50):.3f}s, "
+                f"p95 {percentile(95):.3f}s, max {latencies[-1]:.3f}s")
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        # The threads will open a new session if they are used again
+        self._local = threading.local()
@@ -0,0 +1,94 @@
+import datetime
+import sqlite3
+import threading
+
+
+class ArchiveManifest:
+    """
+    Record of the (province, date) pairs already processed by DataArchive, stored in an sqlite file.
+    A day is "fetched" when its rows are in the monthly file, "empty" when ARPAV has no table for it and "failed"
+    when the request or the extraction raised an error. Only the days that are not fetched or empty need to be
+    scraped again.
+    """
+
+    FETCHED = "fetched"
+    EMPTY = "empty"
+    FAILED = "failed"
+    DONE_STATUSES = (FETCHED, EMPTY)
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS days (city_name TEXT, date TEXT, status TEXT, "
+                                     "rows INTEGER, updated_at TEXT, PRIMARY KEY (city_name, date))")
+            # The last version of the page of every day, to find the revised bulletins when refreshing
+            self._connection.execute("CREATE TABLE IF NOT EXISTS pages (city_name TEXT, date TEXT, "
+                                     "content_hash TEXT, table_hash TEXT, etag TEXT, last_modified TEXT, "
+                                     "checked_at TEXT, PRIMARY KEY (city_name, date))")
+
+    @staticmethod
+    def _date_key(date):
+        return date.strftime("%Y-%m-%d")
+
+    def statuses(self, start_date, end_date):
+        """ Return a dict {(city_name, 'YYYY-MM-DD'): status} of the days in [start_date, end_date) """
+        with self._lock:
+            rows = self._connection.execute("SELECT city_name, date, status FROM days WHERE date >= ? AND date < ?",
+                                            (self._date_key(start_date), self._date_key(end_date))).fetchall()
+        return {(city_name, date): status for city_name, date, status in rows}
+
+    def is_done(self, statuses, city_name, date):
+        return statuses.get((city_name, self._date_key(date))) in self.DONE_STATUSES
+
+    def has_month(self, year, month):
+        first_day = datetime.date(year, month, 1)
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM days WHERE date >= ? AND date < ? LIMIT 1",
+                                           (self._date_key(first_day),
+                                            self._date_key(_next_month(first_day)))).fetchone()
+        return row is not None
+
+    def mark(self, entries):
+        """ Store the status of many days at once. entries is a list of (city_name, date, status, rows) """
+        updated_at = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?, ?)",
+                                         [(city_name, self._date_key(date), status, rows, updated_at)
+                                          for city_name, date, status, rows in entries])
+
+    def page_states(self, start_date, end_date):
+        """
+        Return a dict {(city_name, 'YYYY-MM-DD'): page state} of the days in [start_date, end_date), where the page
+        state is a dict with the 'content_hash' of the page, the 'table_hash' of its cells (see table_cells_hash)
+        and the 'etag' and 'last_modified' HTTP validators (any of them can be None)
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT city_name, date, content_hash, table_hash, etag, last_modified "
+                                            "FROM pages WHERE date >= ? AND date < ?",
+                                            (self._date_key(start_date), self._date_key(end_date))).fetchall()
+        return {(city_name, date): {'content_hash': content_hash, 'table_hash': table_hash, 'etag': etag,
+                                    'last_modified': last_modified}
+                for city_name, date, content_hash, table_hash, etag, last_modified in rows}
+
+    def page_state(self, page_states, city_name, date):
+        return page_states.get((city_name, self._date_key(date)))
+
+    def mark_pages(self, entries):
+        """ Store the page state of many days at once. entries is a list of (city_name, date, page_state) """
+        checked_at = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         [(city_name, self._date_key(date), page_state.get('content_hash'),
+                                           page_state.get('table_hash'), page_state.get('etag'),
+                                           page_state.get('last_modified'), checked_at)
+                                          for city_name, date, page_state in entries])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _next_month(date):
+    return datetime.date(date.year + date.month // 12, date.month % 12 + 1, 1)
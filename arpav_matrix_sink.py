@@ -0,0 +1,220 @@
+import array
+import datetime
+import json
+import math
+import os
+import sys
+
+from arpav_table_cells import parse_cell_value, parse_date
+
+
+class MatrixSink:
+    """
+    Dense version of the archive: a single time x station x variable array of float64 values (NaN for the missing
+    cells and the ones that are not numbers, like "-"), in C order and little endian, in a data file like
+    arpav_matrix.1.f8, plus the axis labels in the arpav_matrix.json sidecar:
+    - data_file: the name of the data file (arpav_matrix.f8 if missing, like in the first version of the sidecar)
+    - start_date: the date of the first day of the time axis (one entry per day, also for the days without data)
+    - stations: the [city_name, station_name] of the station axis
+    - variables: the [pollutant, meas_info, meas_unit] of the variable axis
+    - shape and dtype of the array
+    The file can be opened without parsing with numpy.memmap (see "load_matrix").
+    The days are written in place, so they can be added in any order and replaced (only the stations of the
+    provinces written are reset). The time axis grows by appending to the file, and the sidecar is written after
+    the file (a file longer than the shape of the sidecar, after a crash, is truncated when it is opened again).
+    A new station or variable (a change of the ARPAV table layout, which is rare) needs the whole array to be
+    rewritten with the larger axes: it is written to a new data file, the sidecar is swapped to it and only then
+    the old file is removed, so the sidecar always describes the file it references.
+    """
+
+    data_file_name = "arpav_matrix.f8"
+    labels_file_name = "arpav_matrix.json"
+
+    def __init__(self, arpav_archives_dir):
+        self.arpav_archives_dir = arpav_archives_dir
+        self.labels_path = os.path.join(arpav_archives_dir, self.labels_file_name)
+        self.data_version = 0
+        self.data_path = os.path.join(arpav_archives_dir, self.data_file_name)
+        self.start_date = None
+        self.days = 0
+        self.stations = []
+        self.variables = []
+        if os.path.exists(self.labels_path):
+            with open(self.labels_path, mode="r") as labels_file:
+                labels = json.load(labels_file)
+            self.data_version = labels.get('data_version', 0)
+            self.data_path = os.path.join(arpav_archives_dir, labels.get('data_file', self.data_file_name))
+            self.start_date = datetime.date.fromisoformat(labels['start_date'])
+            self.days = labels['shape'][0]
+            self.stations = [tuple(station) for station in labels['stations']]
+            self.variables = [tuple(variable) for variable in labels['variables']]
+            self._truncate_data_file()
+        self._station_indexes = {station: index for index, station in enumerate(self.stations)}
+        self._variable_indexes = {variable: index for index, variable in enumerate(self.variables)}
+
+    @property
+    def shape(self):
+        return self.days, len(self.stations), len(self.variables)
+
+    def _versioned_data_file_name(self, data_version):
+        name, extension = os.path.splitext(self.data_file_name)
+        return f"{name}.{data_version}{extension}"
+
+    def _truncate_data_file(self):
+        """ Drop the days written after the last sidecar (a crash before "_write_labels") """
+        data_size = self.days * len(self.stations) * len(self.variables) * 8
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) > data_size:
+            with open(self.data_path, mode="r+b") as data_file:
+                data_file.truncate(data_size)
+
+    def append_month(self, year, month, cells):
+        self.replace_days(year, month, days={(cell.city_name, cell.date) for cell in cells}, cells=cells)
+
+    def replace_days(self, year, month, days, cells):
+        """ The stations of the province are set to NaN on those days, and then the values of the cells are set """
+        cities_by_day = {}
+        for city_name, date in days:
+            cities_by_day.setdefault(parse_date(date), set()).add(city_name)
+        day_values = {date: [] for date in cities_by_day}
+        new_stations, new_variables = {}, {}
+        for cell in cells:
+            station = (cell.city_name, cell.station_name)
+            variable = (cell.pollutant, cell.meas_info, cell.meas_unit)
+            if station not in self._station_indexes:
+                new_stations[station] = None
+            if variable not in self._variable_indexes:
+                new_variables[variable] = None
+            day_values.setdefault(parse_date(cell.date), []).append((station, variable,
+                                                                     parse_cell_value(cell.cell_value)[0]))
+        if not day_values:
+            return
+
+        first_date = min(day_values)
+        if self.start_date is None:
+            self.start_date = first_date
+        if new_stations or new_variables or first_date < self.start_date:
+            self._reshape(stations=self.stations + list(new_stations), variables=self.variables + list(new_variables),
+                          start_date=min(first_date, self.start_date))
+
+        variable_count = len(self.variables)
+        day_size = len(self.stations) * variable_count
+        with open(self.data_path, mode="r+b" if os.path.exists(self.data_path) else "w+b") as data_file:
+            for date, values in sorted(day_values.items()):
+                day_index = (date - self.start_date).days
+                # The days without data between the end of the file and this one are NaN
+                self._fill_missing_days(data_file, until_day=day_index, day_size=day_size)
+                day_matrix = array.array('d', [math.nan]) * day_size
+                if day_index < self.days:
+                    # The other provinces of an archived day are kept
+                    data_file.seek(day_index * day_size * day_matrix.itemsize)
+                    day_matrix = self._from_little_endian_bytes(data_file.read(day_size * day_matrix.itemsize))
+                    replaced_cities = cities_by_day.get(date, set())
+                    for station_index, (city_name, _) in enumerate(self.stations):
+                        if city_name in replaced_cities:
+                            day_matrix[station_index * variable_count:(station_index + 1) * variable_count] = \
+                                array.array('d', [math.nan]) * variable_count
+                for station, variable, value in values:
+                    day_matrix[self._station_indexes[station] * variable_count + self._variable_indexes[variable]] = \
+                        value
+                data_file.seek(day_index * day_size * day_matrix.itemsize)
+                data_file.write(self._little_endian_bytes(day_matrix))
+                self.days = max(self.days, day_index + 1)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+        self._write_labels()
+
+    def _fill_missing_days(self, data_file, until_day, day_size):
+        if until_day > self.days:
+            missing_days = array.array('d', [math.nan]) * (day_size * (until_day - self.days))
+            data_file.seek(self.days * day_size * missing_days.itemsize)
+            data_file.write(self._little_endian_bytes(missing_days))
+            self.days = until_day
+
+    @staticmethod
+    def _little_endian_bytes(values):
+        if sys.byteorder == "big":
+            values = array.array('d', values)
+            values.byteswap()
+        return values.tobytes()
+
+    @staticmethod
+    def _from_little_endian_bytes(data):
+        values = array.array('d')
+        values.frombytes(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def _read_days(self):
+        """ Return the whole array as an array('d') """
+        if not (self.days and os.path.exists(self.data_path)):
+            return array.array('d')
+        with open(self.data_path, mode="rb") as data_file:
+            return self._from_little_endian_bytes(data_file.read(self.days * len(self.stations) *
+                                                                 len(self.variables) * 8))
+
+    def _reshape(self, stations, variables, start_date):
+        """
+        Write the array with the new axes to the next version of the data file, then swap the sidecar to it.
+        The existing stations and variables keep their index
+        """
+        old_values = self._read_days()
+        old_station_count, old_variable_count = len(self.stations), len(self.variables)
+        day_offset = (self.start_date - start_date).days
+        days = self.days + day_offset if self.days else 0
+        new_values = array.array('d', [math.nan]) * (days * len(stations) * len(variables))
+        for day_index in range(self.days):
+            for station_index in range(old_station_count):
+                old_start = (day_index * old_station_count + station_index) * old_variable_count
+                new_start = ((day_index + day_offset) * len(stations) + station_index) * len(variables)
+                new_values[new_start:new_start + old_variable_count] = \
+                    old_values[old_start:old_start + old_variable_count]
+
+        # A file left by a crash before the sidecar was swapped has the same name and is simply overwritten
+        old_data_path = self.data_path
+        data_version = self.data_version + 1
+        data_path = os.path.join(self.arpav_archives_dir, self._versioned_data_file_name(data_version))
+        with open(data_path, mode="wb") as data_file:
+            data_file.write(self._little_endian_bytes(new_values))
+            data_file.flush()
+            os.fsync(data_file.fileno())
+        self.data_version, self.data_path = data_version, data_path
+        self.start_date, self.days = start_date, days
+        self.stations, self.variables = stations, variables
+        self._station_indexes = {station: index for index, station in enumerate(stations)}
+        self._variable_indexes = {variable: index for index, variable in enumerate(variables)}
+        self._write_labels()
+        if os.path.exists(old_data_path):
+            os.remove(old_data_path)
+
+    def _write_labels(self):
+        labels = {'data_file': os.path.basename(self.data_path),
+                  'data_version': self.data_version,
+                  'dtype': "<f8",
+                  'shape': list(self.shape),
+                  'start_date': self.start_date.isoformat(),
+                  'stations': [list(station) for station in self.stations],
+                  'variables': [list(variable) for variable in self.variables]}
+        temp_file_path = f"{self.labels_path}.tmp"
+        with open(temp_file_path, mode="w") as labels_file:
+            json.dump(labels, labels_file, ensure_ascii=False, indent=1)
+            labels_file.flush()
+            os.fsync(labels_file.fileno())
+        os.replace(temp_file_path, self.labels_path)
+
+    def close(self):
+        pass
+
+
+def load_matrix(arpav_archives_dir, mode="r"):
+    """
+    Return (matrix, labels): the array of a MatrixSink as a numpy.memmap of shape (days, stations, variables)
+    and its axis labels (see MatrixSink). numpy is only needed by this function.
+    """
+    import numpy as np
+
+    with open(os.path.join(arpav_archives_dir, MatrixSink.labels_file_name), mode="r") as labels_file:
+        labels = json.load(labels_file)
+    data_path = os.path.join(arpav_archives_dir, labels.get('data_file', MatrixSink.data_file_name))
+    matrix = np.memmap(data_path, dtype=labels['dtype'], mode=mode, shape=tuple(labels['shape']))
+    return matrix, labels
@@ -0,0 +1,181 @@
+import bisect
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations (seconds) with fixed buckets, like the Prometheus ones: a duration is counted in the first
+    bucket whose upper bound is greater or equal to it (the last bucket has no upper bound).
+    """
+
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """ Upper bound of the bucket of the q-quantile (the maximum if it is in the last bucket) """
+        rank = q * self.count
+        cumulative_count = 0
+        for bucket_index, bucket_count in enumerate(self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank and cumulative_count > 0:
+                return self.buckets[bucket_index] if bucket_index < len(self.buckets) else self.max
+        return 0.0
+
+    def summary(self):
+        if not self.count:
+            return "-"
+        return (f"{self.count} in {self.sum:.2f}s: mean {self.sum / self.count:.3f}s, "
+                f"p50 <={self.quantile(0.5):.3f}s, p95 <={self.quantile(0.95):.3f}s, max {self.max:.3f}s")
+
+
+class ScrapeMetrics:
+    """
+    Metrics of a scrape, shared by the scraper (fetch and parse stages), its HTTP session (retries) and the
+    DataArchive (write stage and days), so that a slow backfill can be traced back to the network, the parser or
+    the disk:
+    - a LatencyHistogram for each of the stages
+    - counters of the pages, rows, days (fetched, empty, failed, unchanged when refreshing) and retries
+    - the throughput and the ETA of the days to scrape, printed every progress_interval seconds
+    If log_path is given, every day and progress readout is appended to that JSON lines file. If metrics_path is
+    given, the metrics are written to that file in the Prometheus text format (e.g. for the textfile collector of
+    node_exporter) at every progress readout and at the end of the scrape.
+    """
+
+    stages = ("fetch", "parse", "write")
+    counters = ("pages", "rows", "fetched_days", "empty_days", "failed_days", "unchanged_days", "retries")
+
+    def __init__(self, log_path=None, metrics_path=None, progress_interval=10.0):
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.progress_interval = progress_interval
+        self.histograms = {stage: LatencyHistogram() for stage in self.stages}
+        self.counts = dict.fromkeys(self.counters, 0)
+        self.total_days = 0
+        self.done_days = 0
+        self._start_time = None
+        self._last_progress_time = None
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.histograms[stage].observe(seconds)
+
+    @contextlib.contextmanager
+    def time_stage(self, stage):
+        """ Record the duration of the block in the histogram of the stage: "with metrics.time_stage('parse'):" """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counts[counter] += value
+
+    def start(self, total_days):
+        """ Start the throughput and ETA readout of total_days days """
+        self.total_days = total_days
+        self.done_days = 0
+        self._start_time = self._last_progress_time = time.monotonic()
+        self.log_event("start", total_days=total_days)
+
+    def day_done(self, city_name, date, status, rows):
+        """ Count a day that was scraped (status is one of the ArchiveManifest statuses or "unchanged") """
+        with self._lock:
+            self.done_days += 1
+            self.counts[f"{status}_days"] += 1
+            self.counts["rows"] += rows
+        self.log_event("day", city_name=city_name, date=f"{date:%Y-%m-%d}", status=status, rows=rows)
+        if time.monotonic() - self._last_progress_time >= self.progress_interval:
+            self.report_progress()
+
+    def throughput(self):
+        """ Return the days scraped per second and the estimated seconds to the end (None before the start) """
+        if self._start_time is None or not self.done_days:
+            return 0.0, None
+        days_per_second = self.done_days / max(time.monotonic() - self._start_time, 1e-9)
+        return days_per_second, (self.total_days - self.done_days) / days_per_second
+
+    def progress_line(self):
+        days_per_second, eta_seconds = self.throughput()
+        eta = str(datetime.timedelta(seconds=round(eta_seconds))) if eta_seconds is not None else "-"
+        return (f"{self.done_days}/{self.total_days} days, {days_per_second:.2f} days/s, ETA {eta} "
+                f"(fetch {self.histograms['fetch'].sum:.1f}s, parse {self.histograms['parse'].sum:.1f}s, "
+                f"write {self.histograms['write'].sum:.1f}s, {self.counts['retries']} retries)")
+
+    def report_progress(self):
+        self._last_progress_time = time.monotonic()
+        print(f"Progress: {self.progress_line()}")
+        days_per_second, eta_seconds = self.throughput()
+        self.log_event("progress", done_days=self.done_days, total_days=self.total_days,
+                       days_per_second=days_per_second, eta_seconds=eta_seconds)
+        self.write_metrics_file()
+
+    def finish(self):
+        """ Log the final metrics and write the metrics file """
+        self.log_event("finish", counts=self.counts,
+                       stages={stage: {'count': histogram.count, 'sum': histogram.sum, 'max': histogram.max}
+                               for stage, histogram in self.histograms.items()})
+        self.write_metrics_file()
+
+    def summary(self):
+        """ Return a multi-line string with the histogram summary of every stage and the counters """
+        lines = [f"{stage}: {histogram.summary()}" for stage, histogram in self.histograms.items()]
+        lines.append(", ".join(f"{counter}: {count}" for counter, count in self.counts.items()))
+        return "\n".join(lines)
+
+    def log_event(self, event, **fields):
+        if self.log_path is None:
+            return
+        record = {'time': datetime.datetime.now().isoformat(timespec="milliseconds"), 'event': event, **fields}
+        with self._lock:
+            with open(self.log_path, mode="a") as log_file:
+                log_file.write(json.dumps(record) + "\n")
+
+    def metrics_text(self):
+        """ Return the metrics in the Prometheus text format """
+        lines = ["# TYPE arpav_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(histogram.buckets + ("+Inf",), histogram.bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(f'arpav_stage_seconds_bucket{{stage="{stage}",le="{upper_bound}"}} '
+                                 f'{cumulative_count}')
+                lines.append(f'arpav_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'arpav_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for counter, count in self.counts.items():
+                lines.append(f"# TYPE arpav_{counter}_total counter")
+                lines.append(f"arpav_{counter}_total {count}")
+        days_per_second, eta_seconds = self.throughput()
+        lines.extend(["# TYPE arpav_days_to_scrape gauge", f"arpav_days_to_scrape {self.total_days - self.done_days}",
+                      "# TYPE arpav_days_per_second gauge", f"arpav_days_per_second {days_per_second}",
+                      "# TYPE arpav_eta_seconds gauge",
+                      f"arpav_eta_seconds {eta_seconds if eta_seconds is not None else 'NaN'}"])
+        return "\n".join(lines) + "\n"
+
+    def write_metrics_file(self):
+        if self.metrics_path is None:
+            return
+        # Written atomically, so that a collector never reads a partial file
+        temporary_path = f"{self.metrics_path}.tmp"
+        with open(temporary_path, mode="w") as metrics_file:
+            metrics_file.write(self.metrics_text())
+        os.replace(temporary_path, self.metrics_path)
@@ -0,0 +1,123 @@
+import argparse
+import csv
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from arpav_table_cells import TableCell, parse_cell_value, parse_date
+
+DIMENSION_COLUMNS = ['pollutant', 'meas_info', 'meas_unit', 'station_name', 'city_name']
+
+# The dimensions repeat the same few strings on every row, so they are dictionary encoded
+ARPAV_PARQUET_SCHEMA = pa.schema(
+    [pa.field('cell_value', pa.float64()),
+     # The original text is kept only for the cells that are not numbers (e.g. "-" or values with notes)
+     pa.field('cell_text', pa.string())]
+    + [pa.field(column, pa.dictionary(pa.int32(), pa.string())) for column in DIMENSION_COLUMNS]
+    + [pa.field('date', pa.date32())]
+)
+
+
+def cells_to_table(cells):
+    """ Convert the TableCells to a typed pyarrow Table """
+    values, texts = [], []
+    for cell in cells:
+        value, text = parse_cell_value(cell.cell_value)
+        values.append(value)
+        texts.append(text)
+    columns = {'cell_value': pa.array(values, type=pa.float64()),
+               'cell_text': pa.array(texts, type=pa.string())}
+    for column in DIMENSION_COLUMNS:
+        columns[column] = pa.array([getattr(cell, column) for cell in cells], type=pa.string()).dictionary_encode()
+    columns['date'] = pa.array([parse_date(cell.date) for cell in cells], type=pa.date32())
+    return pa.Table.from_arrays([columns[field.name] for field in ARPAV_PARQUET_SCHEMA], schema=ARPAV_PARQUET_SCHEMA)
+
+
+class ParquetSink:
+    """
+    Columnar version of the monthly archive: {year}/{month}/{year}_{month}_arpav_data.parquet,
+    with numeric values, real dates and dictionary encoded dimensions.
+    """
+
+    def __init__(self, arpav_archives_dir, compression="zstd"):
+        self.arpav_archives_dir = arpav_archives_dir
+        self.compression = compression
+
+    def monthly_file_path(self, year, month):
+        return os.path.join(self.arpav_archives_dir, f'{year}/{month}', f'{year}_{month}_arpav_data.parquet')
+
+    def read_month(self, year, month):
+        monthly_file_path = self.monthly_file_path(year, month)
+        if not os.path.exists(monthly_file_path):
+            return None
+        return pq.read_table(monthly_file_path, schema=ARPAV_PARQUET_SCHEMA)
+
+    def append_month(self, year, month, cells):
+        """
+        Add the cells to the monthly file. Like for the CSV archive, the file is rewritten in a temporary file that
+        replaces the old one, with the rows sorted by date, and the days already in the file are replaced.
+        """
+        if not cells:
+            return
+        self.replace_days(year, month, days={(cell.city_name, cell.date) for cell in cells}, cells=cells)
+
+    def replace_days(self, year, month, days, cells):
+        existing_table = self.read_month(year, month)
+        if existing_table is not None:
+            day_keys = {(city_name, parse_date(date)) for city_name, date in days}
+            kept_rows = [(city_name, date) not in day_keys
+                         for city_name, date in zip(existing_table.column('city_name').to_pylist(),
+                                                    existing_table.column('date').to_pylist())]
+            existing_table = existing_table.filter(pa.array(kept_rows, type=pa.bool_()))
+        self._write_month(year, month, existing_table=existing_table, cells=cells)
+
+    def _write_month(self, year, month, existing_table, cells):
+        table = cells_to_table(cells)
+        if existing_table is not None:
+            table = pa.concat_tables([existing_table, table])
+        # Resumed days may come before the ones already archived. The sort is stable, so the order of the rows
+        # of the same day is kept
+        table = table.unify_dictionaries().combine_chunks()
+        table = table.take(pc.sort_indices(table, sort_keys=[('date', 'ascending')]))
+        self._write_table(table, self.monthly_file_path(year, month))
+
+    def _write_table(self, table, monthly_file_path):
+        os.makedirs(os.path.dirname(monthly_file_path), exist_ok=True)
+        temp_file_path = f"{monthly_file_path}.tmp"
+        pq.write_table(table, temp_file_path, compression=self.compression, use_dictionary=True)
+        os.replace(temp_file_path, monthly_file_path)
+
+    def convert_csv_archive(self, csv_archives_dir):
+        """ Convert every monthly CSV file of csv_archives_dir ({year}/{month}/{year}_{month}_arpav_data.csv) """
+        converted_files = 0
+        for year in sorted(os.listdir(csv_archives_dir)):
+            year_dir = os.path.join(csv_archives_dir, year)
+            if not year.isdigit() or not os.path.isdir(year_dir):
+                continue
+            for month in sorted(os.listdir(year_dir), key=lambda m: int(m) if m.isdigit() else 0):
+                csv_file_path = os.path.join(year_dir, month, f'{year}_{month}_arpav_data.csv')
+                if not os.path.exists(csv_file_path):
+                    continue
+                with open(csv_file_path, mode="r", newline="") as csv_file:
+                    table = cells_to_table([TableCell(**row) for row in csv.DictReader(csv_file)])
+                self._write_table(table, self.monthly_file_path(year, month))
+                converted_files += 1
+                print(f"Converted {csv_file_path} ({table.num_rows} rows)")
+        return converted_files
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a monthly CSV archive of ARPAV data to Parquet")
+    parser.add_argument("csv_archives_dir")
+    parser.add_argument("parquet_archives_dir")
+    parser.add_argument("--compression", default="zstd")
+    args = parser.parse_args()
+
+    converted = ParquetSink(args.parquet_archives_dir,
+                            compression=args.compression).convert_csv_archive(args.csv_archives_dir)
+    print(f"Converted {converted} monthly files")
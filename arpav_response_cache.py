@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class CacheMissError(LookupError):
+    """ Raised in replay mode when the requested page is not in the cache """
+
+
+class CachedResponse:
+    """ Minimal replacement of requests.Response for the pages read from the ResponseCache """
+
+    status_code = 200
+
+    def __init__(self, content, encoding):
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class ResponseCache:
+    """
+    On-disk cache of the raw pages returned by the ARPAV archive.
+    The pages are stored gzip compressed in "objects/", named after the sha256 of their content, so that identical
+    pages (e.g. all the bulletins without data) are stored only once.
+    An sqlite index maps every request (the form data, which contains province and date) to its page.
+    If max_size_bytes is set, the least recently used pages are removed (together with all the requests that
+    return them) when the compressed pages exceed it. A page is as recent as the last request that returned it,
+    so a page shared by many requests (e.g. the bulletins without data) is kept while any of them is recent.
+    The accesses are only tracked with max_size_bytes, and they are written to the index in batches, so that
+    a replay reads the pages at disk speed.
+    """
+
+    # Pages read by the eviction (and accesses buffered before being written to the index) at a time
+    batch_size = 500
+
+    def __init__(self, cache_dir, max_size_bytes=None):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses (request_key TEXT PRIMARY KEY, "
+                                     "city_name TEXT, date TEXT, content_hash TEXT, encoding TEXT, "
+                                     "stored_at REAL, last_access REAL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS objects (content_hash TEXT PRIMARY KEY, "
+                                     "size INTEGER, last_access REAL)")
+            object_columns = [row[1] for row in self._connection.execute("PRAGMA table_info(objects)")]
+            if "last_access" not in object_columns:
+                # A cache created before the pages had their own last access
+                self._connection.execute("ALTER TABLE objects ADD COLUMN last_access REAL")
+                self._connection.execute("UPDATE objects SET last_access = (SELECT MAX(last_access) FROM responses "
+                                         "WHERE responses.content_hash = objects.content_hash)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_content_hash "
+                                     "ON responses (content_hash)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS objects_last_access ON objects (last_access)")
+        # The size of the objects is kept up to date here instead of being summed at every put
+        self._size_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        # {request_key: (last access, content_hash)} of the pages read since the last write to the index
+        self._pending_accesses = {}
+
+    @staticmethod
+    def request_key(post_data):
+        return hashlib.sha256(json.dumps(post_data, sort_keys=True).encode()).hexdigest()
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash[:2], f"{content_hash}.html.gz")
+
+    def get(self, post_data):
+        """ Return the CachedResponse of the request or None if it is not in the cache """
+        request_key = self.request_key(post_data)
+        with self._lock:
+            row = self._connection.execute("SELECT content_hash, encoding FROM responses WHERE request_key = ?",
+                                           (request_key,)).fetchone()
+            if row is None:
+                return None
+            if self.max_size_bytes is not None:
+                self._pending_accesses[request_key] = (time.time(), row[0])
+                if len(self._pending_accesses) >= self.batch_size:
+                    self._flush_accesses()
+        content_hash, encoding = row
+        try:
+            with gzip.open(self._object_path(content_hash), mode="rb") as object_file:
+                return CachedResponse(content=object_file.read(), encoding=encoding)
+        except FileNotFoundError:
+            return None
+
+    def put(self, post_data, content, encoding=None):
+        """ Store the raw content (bytes) of the answer to the request """
+        content_hash = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(content_hash)
+        with self._lock:
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                # Write in a temporary file first, so that a crash cannot leave a truncated page in the cache
+                temp_path = f"{object_path}.{threading.get_ident()}.tmp"
+                with gzip.open(temp_path, mode="wb") as object_file:
+                    object_file.write(content)
+                os.replace(temp_path, object_path)
+            now = time.time()
+            request_key = self.request_key(post_data)
+            with self._connection:
+                if self._connection.execute("SELECT 1 FROM objects WHERE content_hash = ?",
+                                            (content_hash,)).fetchone() is None:
+                    size = os.path.getsize(object_path)
+                    self._connection.execute("INSERT INTO objects (content_hash, size, last_access) VALUES (?, ?, ?)",
+                                             (content_hash, size, now))
+                    self._size_bytes += size
+                else:
+                    self._connection.execute("UPDATE objects SET last_access = ? WHERE content_hash = ?",
+                                             (now, content_hash))
+                old_row = self._connection.execute("SELECT content_hash FROM responses WHERE request_key = ?",
+                                                   (request_key,)).fetchone()
+                self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         (request_key, post_data.get("provincia"), self._form_date(post_data),
+                                          content_hash, encoding, now, now))
+                self._pending_accesses.pop(request_key, None)
+                # A page stored again with a new content: the old one is removed if no other request returns it
+                if old_row is not None and old_row[0] != content_hash and self._connection.execute(
+                        "SELECT 1 FROM responses WHERE content_hash = ? LIMIT 1", (old_row[0],)).fetchone() is None:
+                    self._remove_object(old_row[0])
+            if self.max_size_bytes is not None:
+                self._evict()
+        return content_hash
+
+    @staticmethod
+    def _form_date(post_data):
+        try:
+            return f"{post_data['anno']}-{post_data['mese']}-{post_data['giorno']}"
+        except KeyError:
+            return None
+
+    def iter_entries(self):
+        """ Yield (city_name, 'YYYY-MM-DD', CachedResponse) for every request in the cache """
+        with self._lock:
+            rows = self._connection.execute("SELECT city_name, date, content_hash, encoding FROM responses "
+                                            "ORDER BY date, city_name").fetchall()
+        for city_name, date, content_hash, encoding in rows:
+            try:
+                with gzip.open(self._object_path(content_hash), mode="rb") as object_file:
+                    yield city_name, date, CachedResponse(content=object_file.read(), encoding=encoding)
+            except FileNotFoundError:
+                continue
+
+    def size_bytes(self):
+        with self._lock:
+            return self._size_bytes
+
+    def _flush_accesses(self):
+        # This must be called while holding self._lock
+        if not self._pending_accesses:
+            return
+        with self._connection:
+            self._connection.executemany("UPDATE responses SET last_access = ? WHERE request_key = ?",
+                                         [(last_access, request_key)
+                                          for request_key, (last_access, _) in self._pending_accesses.items()])
+            self._connection.executemany("UPDATE objects SET last_access = MAX(COALESCE(last_access, 0), ?) "
+                                         "WHERE content_hash = ?", self._pending_accesses.values())
+        self._pending_accesses = {}
+
+    def _remove_object(self, content_hash):
+        # This must be called while holding self._lock, in a transaction
+        size = self._connection.execute("SELECT size FROM objects WHERE content_hash = ?",
+                                        (content_hash,)).fetchone()
+        self._connection.execute("DELETE FROM objects WHERE content_hash = ?", (content_hash,))
+        try:
+            os.remove(self._object_path(content_hash))
+        except FileNotFoundError:
+            pass
+        self._size_bytes -= size[0] if size is not None else 0
+
+    def _evict(self):
+        """
+        Remove the least recently used pages, with all the requests that return them, until the cache fits in
+        max_size_bytes. Every page removed frees its bytes, and only the oldest pages are read from the index.
+        """
+        # This must be called while holding self._lock
+        if self._size_bytes <= self.max_size_bytes:
+            return
+        self._flush_accesses()
+        with self._connection:
+            while self._size_bytes > self.max_size_bytes:
+                content_hashes = [row[0] for row in self._connection.execute(
+                    "SELECT content_hash FROM objects ORDER BY last_access LIMIT ?", (self.batch_size,))]
+                if not content_hashes:
+                    break
+                for content_hash in content_hashes:
+                    self._connection.execute("DELETE FROM responses WHERE content_hash = ?", (content_hash,))
+                    self._remove_object(content_hash)
+                    if self._size_bytes <= self.max_size_bytes:
+                        break
+
+    def close(self):
+        with self._lock:
+            self._flush_accesses()
+            self._connection.close()
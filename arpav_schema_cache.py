@@ -0,0 +1,74 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from arpav_table_cells import link_table_columns
+
+
+def header_fingerprint(table):
+    """ Hash of the text, link text and 'x' of the cells of the three header rows of the BulletinTable """
+    header_rows = [[(cell['text'], cell['link_text'], cell['x']) for cell in table.row_cells(row_index)]
+                   for row_index in range(3)]
+    return hashlib.sha1(json.dumps(header_rows).encode()).hexdigest()
+
+
+class HeaderSchemaCache:
+    """
+    Cache of the data columns (pollutant, meas_info, meas_unit) of every header layout of the ARPAV table.
+    The header rows hardly ever change between the days of a province, so the columns are linked only the first
+    time a layout is seen. Every new layout gets a schema version, which is printed and, if log_path is given,
+    appended to that JSON lines file, so that the changes of the ARPAV table format can be tracked.
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.versions = []
+        self.hits = 0
+        self.misses = 0
+        self._data_columns = {}
+        self._lock = threading.Lock()
+        if log_path is not None and os.path.exists(log_path):
+            self._load_versions()
+
+    def _load_versions(self):
+        # The layouts found by the previous runs are known already and keep their version
+        with open(self.log_path, mode="r") as log_file:
+            for line in log_file:
+                if line.strip():
+                    version = json.loads(line)
+                    self.versions.append(version)
+                    self._data_columns[version['fingerprint']] = [tuple(column) for column in version['columns']]
+
+    def get_data_columns(self, table, city_name, date):
+        fingerprint = header_fingerprint(table)
+        with self._lock:
+            data_columns = self._data_columns.get(fingerprint)
+            if data_columns is not None:
+                self.hits += 1
+                return data_columns
+            self.misses += 1
+
+        data_columns = link_table_columns(table)
+        with self._lock:
+            if fingerprint not in self._data_columns:
+                self._data_columns[fingerprint] = data_columns
+                self._log_new_version(fingerprint=fingerprint, data_columns=data_columns, city_name=city_name,
+                                      date=date)
+        return data_columns
+
+    def _log_new_version(self, fingerprint, data_columns, city_name, date):
+        # This must be called while holding self._lock
+        version = {'version': len(self.versions) + 1,
+                   'fingerprint': fingerprint,
+                   'city_name': city_name,
+                   'first_date': str(date),
+                   'found_at': datetime.datetime.now().isoformat(timespec="seconds"),
+                   'columns': data_columns}
+        self.versions.append(version)
+        print(f"New table layout (schema version {version['version']}, {fingerprint[:12]}) found for {city_name} "
+              f"on {date}: {len(data_columns)} data columns")
+        if self.log_path is not None:
+            with open(self.log_path, mode="a") as log_file:
+                log_file.write(json.dumps(version) + "\n")
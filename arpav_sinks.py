@@ -0,0 +1,131 @@
+import csv
+import os
+import sqlite3
+
+from arpav_table_cells import TABLE_CELL_FIELDNAMES, parse_date
+
+# Every sink receives the TableCells of the archive one month at a time through
+# "append_month(year, month, cells)" and is closed with "close()". In the file and database sinks, appending
+# a day that is already archived replaces it, so a month can be written again after a crash. The sinks that
+# can be refreshed (see DataArchive.refresh_archived_data) also have "replace_days(year, month, days, cells)",
+# that replaces the rows of the (city_name, date) in days with the cells.
+# The Parquet sink is in arpav_parquet_sink.py, since it needs pyarrow, and the dense array of
+# arpav_matrix_sink.py is in its own module like the other optional formats.
+
+
+def _cell_days(cells):
+    """ The (city_name, date) of the days of the cells """
+    return {(cell.city_name, cell.date) for cell in cells}
+
+
+class CsvSink:
+    """
+    Monthly CSV files {year}/{month}/{year}_{month}_arpav_data.csv.
+    Every month is rewritten in a temporary file that replaces the old one, so a crash leaves either the old
+    or the new file.
+    """
+
+    def __init__(self, arpav_archives_dir, fieldnames=TABLE_CELL_FIELDNAMES):
+        self.arpav_archives_dir = arpav_archives_dir
+        self.fieldnames = fieldnames
+
+    def monthly_file_path(self, year, month):
+        return os.path.join(self.arpav_archives_dir, f'{year}/{month}', f'{year}_{month}_arpav_data.csv')
+
+    def read_month(self, year, month):
+        """ Return the rows (dicts of strings) of the monthly file """
+        monthly_file_path = self.monthly_file_path(year, month)
+        if not os.path.exists(monthly_file_path):
+            return []
+        with open(monthly_file_path, mode="r", newline="") as csv_file:
+            return list(csv.DictReader(csv_file))
+
+    def append_month(self, year, month, cells):
+        # The rows of days that are already in the file are replaced, so appending the same days again
+        # (e.g. after a crash between the write and the manifest update) does not duplicate them
+        self.replace_days(year, month, days=_cell_days(cells), cells=cells)
+
+    def replace_days(self, year, month, days, cells):
+        day_keys = {(city_name, f"{parse_date(date):%Y-%m-%d}") for city_name, date in days}
+        month_rows = [row for row in self.read_month(year, month)
+                      if (row['city_name'], row['date'][:10]) not in day_keys]
+        self._write_month(year, month, month_rows + [cell.as_dict() for cell in cells])
+
+    def _write_month(self, year, month, month_rows):
+        monthly_file_path = self.monthly_file_path(year, month)
+        os.makedirs(os.path.dirname(monthly_file_path), exist_ok=True)
+        # Resumed days may come before the ones already archived. The sort is stable, so the order of the rows
+        # of the same day is kept
+        month_rows.sort(key=lambda row: str(row['date']))
+        temp_file_path = f"{monthly_file_path}.tmp"
+        with open(temp_file_path, mode="w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=self.fieldnames)
+            writer.writeheader()
+            writer.writerows(month_rows)
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
+        os.replace(temp_file_path, monthly_file_path)
+
+    def close(self):
+        pass
+
+
+class SqliteSink:
+    """
+    Single sqlite database with a "table_cells" table. The cells of a month are inserted in one transaction.
+    """
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._connection = sqlite3.connect(database_path)
+        with self._connection:
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS table_cells "
+                                     f"({', '.join(TABLE_CELL_FIELDNAMES)})")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS table_cells_date ON table_cells (date)")
+
+    def append_month(self, year, month, cells):
+        # Like for the CSV files, the days already in the table are replaced
+        self.replace_days(year, month, days=_cell_days(cells), cells=cells)
+
+    def replace_days(self, year, month, days, cells):
+        with self._connection:
+            self._connection.executemany("DELETE FROM table_cells WHERE city_name = ? AND date >= ? AND date < ?",
+                                         ((city_name, f"{parse_date(date):%Y-%m-%d}",
+                                           f"{parse_date(date):%Y-%m-%d}~") for city_name, date in days))
+            self._insert_cells(cells)
+
+    def _insert_cells(self, cells):
+        self._connection.executemany(
+            f"INSERT INTO table_cells VALUES ({', '.join('?' for _ in TABLE_CELL_FIELDNAMES)})",
+            ((cell.cell_value, cell.pollutant, cell.meas_info, cell.meas_unit, cell.station_name,
+              cell.city_name, str(cell.date)) for cell in cells))
+
+    def close(self):
+        self._connection.close()
+
+
+class MemorySink:
+    """
+    Keep the cells in the "cells" list, or pass every cell to consumer(cell) if a consumer is given
+    (e.g. to process the scraped values without writing any file).
+    """
+
+    def __init__(self, consumer=None):
+        self.consumer = consumer
+        self.cells = []
+
+    def append_month(self, year, month, cells):
+        if self.consumer is None:
+            self.cells.extend(cells)
+        else:
+            for cell in cells:
+                self.consumer(cell)
+
+    def replace_days(self, year, month, days, cells):
+        """ The cells of the days are removed from "cells" (a consumer simply receives the new ones) """
+        day_keys = {(city_name, parse_date(date)) for city_name, date in days}
+        self.cells = [cell for cell in self.cells if (cell.city_name, parse_date(cell.date)) not in day_keys]
+        self.append_month(year, month, cells)
+
+    def close(self):
+        pass
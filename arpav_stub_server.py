@@ -0,0 +1,89 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMPTY_BULLETIN_PAGE = "<html><body><div id='ariadativalidati'></div></body></html>"
+
+
+def recorded_page_path(recordings_dir, city_name, year, month, day):
+    """ Path of the recorded page of a bulletin (the form values are the ones sent by the scraper) """
+    return os.path.join(recordings_dir, city_name, f"{year}_{month}_{day}.html")
+
+
+class ArpavStubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answer to the POST form of the ARPAV validated data archive with the recorded pages found in
+    server.recordings_dir. The dates without a recorded page get a bulletin without table, like ARPAV does
+    for the days without data.
+    Every page has an ETag (hash of its content), and a request with the same If-None-Match gets a
+    304 Not Modified, so that the refresh of the archive can be tried locally.
+    """
+
+    def do_POST(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        form = urllib.parse.parse_qs(self.rfile.read(content_length).decode())
+        try:
+            page_path = recorded_page_path(self.server.recordings_dir, form["provincia"][0], form["anno"][0],
+                                           form["mese"][0], form["giorno"][0])
+        except KeyError:
+            self.send_error(400, "Missing form values")
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if os.path.exists(page_path):
+            with open(page_path, mode="rb") as page_file:
+                page = page_file.read()
+        else:
+            page = EMPTY_BULLETIN_PAGE.encode()
+
+        etag = f'"{hashlib.sha1(page).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start_stub_server(recordings_dir, host="127.0.0.1", port=0, latency=0.0, verbose=False):
+    """
+    Start the stub server in a background thread and return it together with its URL
+    (port=0 means that a free port is chosen). Call "server.shutdown()" to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), ArpavStubRequestHandler)
+    server.daemon_threads = True
+    server.recordings_dir = recordings_dir
+    server.latency = latency
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/aria_dati_validati_storico.php"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded ARPAV bulletins on a local HTTP server")
+    parser.add_argument("recordings_dir")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every answer")
+    args = parser.parse_args()
+
+    stub_server, url = start_stub_server(args.recordings_dir, port=args.port, latency=args.latency, verbose=True)
+    print(f"Serving the recorded bulletins of {args.recordings_dir} at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub_server.shutdown()
@@ -0,0 +1,145 @@
+import bisect
+import datetime
+import hashlib
+import json
+import math
+
+
+class TableCell:
+    """
+    A single value of the ARPAV table, with the pollutant/measurement columns and the station row it belongs to.
+    The __slots__ keep every record small, so that many days can be streamed or buffered without much memory.
+    """
+
+    __slots__ = ('cell_value', 'pollutant', 'meas_info', 'meas_unit', 'station_name', 'city_name', 'date')
+
+    def __init__(self, cell_value, pollutant, meas_info, meas_unit, station_name, city_name, date):
+        self.cell_value = cell_value
+        self.pollutant = pollutant
+        self.meas_info = meas_info
+        self.meas_unit = meas_unit
+        self.station_name = station_name
+        self.city_name = city_name
+        self.date = date
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return f"TableCell({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
+
+
+TABLE_CELL_FIELDNAMES = list(TableCell.__slots__)
+
+
+def parse_cell_value(cell_value):
+    """ Return (value, text): the float of the cell if it is a number, otherwise NaN and the original text """
+    try:
+        value = float(str(cell_value).strip().replace(",", "."))
+    except ValueError:
+        return math.nan, cell_value
+    if math.isnan(value):
+        return math.nan, cell_value
+    return value, None
+
+
+def parse_date(date):
+    """ The rows can have the date as datetime (scraper) or as text (CSV archive, e.g. '2015-01-01 00:00:00') """
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.datetime.strptime(str(date)[:10], "%Y-%m-%d").date()
+
+
+def table_cells_hash(cells):
+    """
+    Hash of the values of the TableCells of a day (of an empty list if there is no table), used to detect
+    the revisions of a bulletin also when the rest of the page changes
+    """
+    return hashlib.sha1(json.dumps([[cell.cell_value, cell.pollutant, cell.meas_info, cell.meas_unit,
+                                     cell.station_name] for cell in cells]).encode()).hexdigest()
+
+
+def _column_owner_index(column_xs, x):
+    """
+    Index of the upper header cell a column at x belongs to: the last one with 'x' lower or equal to x.
+    The columns before the first header cell (and after the last one) belong to the last header cell.
+    """
+    owner_index = bisect.bisect_right(column_xs, x) - 1
+    return owner_index if owner_index >= 0 else len(column_xs) - 1
+
+
+def link_meas_info_to_pollutant_columns(pollutant_list, measurement_info):
+
+    # Reorganize the measurement_infos (like "max ora"/"media giorn."/... ) according
+    # to the category and the pollutant they belong to
+    if not pollutant_list:
+        return
+    pollutant_xs = [pollutant['x'] for pollutant in pollutant_list]
+    for meas_info in measurement_info:
+        meas_info['pollutant'] = pollutant_list[_column_owner_index(pollutant_xs, meas_info['x'])]['text']
+
+
+def link_meas_units_to_meas_info_columns(measurement_info, measurement_units):
+
+    # Reorganize the measurement_units (like conc./ora/sup ) according to the category and the pollutant they belong to
+    if not measurement_info:
+        return
+    meas_info_xs = [meas_info['x'] for meas_info in measurement_info]
+    for meas_unit in measurement_units:
+        meas_info = measurement_info[_column_owner_index(meas_info_xs, meas_unit['x'])]
+        meas_unit['meas_info'] = meas_info['text']
+        meas_unit['pollutant'] = meas_info['pollutant']
+
+
+def link_table_columns(table):
+    """
+    Return the (pollutant, meas_info, meas_unit) of every data column of the BulletinTable.
+    The basic idea is to avoid to blindly pick the cell by its index, but trying to get that based on the pollutant
+    it corresponds to (from first row), the measurement_info (2nd row) and measurement_unit (3rd row).
+    In order to recognize and connect these columns with the table cells we use the 'x' of those cells (rendered
+    x coordinate or column index).
+    """
+    # Retrieve data of the pollutants of the first row and the categories of the second row
+    pollutant_list = [{'text': c['text'], 'x': c['x']} for c in table.row_cells(0)]
+
+    # If there is no link in the cell, the whole cell text is used
+    measurement_info = [{'text': c['link_text'] if c['link_text'] is not None else c['text'],
+                         'x': c['x']} for c in table.row_cells(1)]
+    link_meas_info_to_pollutant_columns(pollutant_list=pollutant_list, measurement_info=measurement_info)
+
+    measurement_units = [{'meas_units': c['text'], 'x': c['x']} for c in table.row_cells(2)]
+    link_meas_units_to_meas_info_columns(measurement_info=measurement_info, measurement_units=measurement_units)
+
+    # The first three columns of measurement units are only metadata and we can discard them
+    del measurement_units[:3]
+    return [(meas_unit['pollutant'], meas_unit['meas_info'], meas_unit['meas_units'])
+            for meas_unit in measurement_units]
+
+
+def iter_table_cells(table, city_name, date, schema_cache=None):
+    """
+    Yield a TableCell for every value of the BulletinTable (nothing if the table is empty).
+    If a schema_cache is given (see arpav_schema_cache.py), the header rows are linked only the first time
+    a layout is seen.
+    """
+    if table.row_cells(0) == []:
+        return
+    if schema_cache is None:
+        data_columns = link_table_columns(table)
+    else:
+        data_columns = schema_cache.get_data_columns(table=table, city_name=city_name, date=date)
+
+    cityname_list = table.station_names()
+
+    for i, (pollutant, meas_info, meas_unit) in enumerate(data_columns):
+        for j in range(len(cityname_list)):
+            # I have to add 3 to row and col index because the first 3 rows and columns are metadata
+            yield TableCell(cell_value=table.cell_text(j + 3, i + 3),
+                            pollutant=pollutant,
+                            meas_info=meas_info,
+                            meas_unit=meas_unit,
+                            station_name=cityname_list[j],
+                            city_name=city_name,
+                            date=date)
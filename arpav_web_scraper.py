@@ -0,0 +1,409 @@
+import collections
+import datetime
+import hashlib
+import os
+
+from arpav_archive_index import ArchiveIndex
+from arpav_concurrent_fetch import ConcurrentFetcher
+from arpav_html_parser import parse_bulletin_table
+from arpav_manifest import ArchiveManifest
+from arpav_metrics import ScrapeMetrics
+from arpav_response_cache import CacheMissError
+from arpav_schema_cache import HeaderSchemaCache
+from arpav_sinks import CsvSink, SqliteSink
+from arpav_table_cells import iter_table_cells, table_cells_hash
+
+
+class ArpavArchiveScraper:
+
+    arpav_air_data_archive_url = "https://www.arpa.veneto.it/arpavinforma/bollettini/aria/aria_dati_validati_storico.php"
+
+    def __init__(self, arpav_air_data_archive_url=None, http_session=None, response_cache=None, replay=False,
+                 schema_cache=None, metrics=None):
+        # A different URL can be used to scrape a local copy of the archive (see arpav_stub_server.py)
+        if arpav_air_data_archive_url is not None:
+            self.arpav_air_data_archive_url = arpav_air_data_archive_url
+        # Every page downloaded is stored in the response_cache (if any). In replay mode the pages are only read
+        # from the cache and no request is sent to ARPAV
+        if replay and response_cache is None:
+            raise ValueError("The replay mode needs a response_cache to read the pages from")
+        # The fetch and parse durations and the pages (and the retries of the HTTP session) are recorded here
+        self.metrics = metrics if metrics is not None else ScrapeMetrics()
+        # The session keeps the connections alive between the days and retries the failed requests
+        if http_session is None and not replay:
+            # requests is imported only when the pages are actually downloaded
+            from arpav_http_session import ArpavHttpSession
+            http_session = ArpavHttpSession(metrics=self.metrics)
+        self.http_session = http_session
+        # The columns of the header layouts that were already seen are not linked again
+        self.schema_cache = schema_cache if schema_cache is not None else HeaderSchemaCache()
+        self.response_cache = response_cache
+        self.replay = replay
+
+    def _get_data_from_table_by_cityname(self, date_response, city_name, date):
+        """
+        Return the TableCells of the table returned by the POST request (see "iter_table_cells").
+        The columns are linked through their column index, that is computed from the colspan structure of the HTML
+        table, so no browser is needed.
+        """
+        with self.metrics.time_stage("parse"):
+            return list(iter_table_cells(table=parse_bulletin_table(date_response.text),
+                                         city_name=city_name, date=date, schema_cache=self.schema_cache))
+
+    def _set_post_request_data(self, city_name, date: datetime):
+
+        return {
+            "Vai": 'Visualizza il bollettino',
+            "provincia": city_name,
+            "giorno": '{:02d}'.format(date.day),
+            "mese": '{:02d}'.format(date.month),
+            "anno": str(date.year)
+        }
+
+    def _get_response(self, post_data):
+        if self.replay:
+            return self.response_cache.get(post_data)
+
+        date_response = self.http_session.post(self.arpav_air_data_archive_url, data=post_data)
+        # An error page (e.g. 429 or 404) has no table either: the day must fail, not be archived as empty
+        date_response.raise_for_status()
+        if self.response_cache is not None and date_response.status_code == 200:
+            self.response_cache.put(post_data, date_response.content, encoding=date_response.encoding)
+        return date_response
+
+    def retrieve_single_data_from_website(self, city_name, date: datetime):
+        """ Return the list of TableCells of the province for that day (empty if there is no data) """
+        post_data = self._set_post_request_data(city_name=city_name, date=date)
+        with self.metrics.time_stage("fetch"):
+            date_response = self._get_response(post_data=post_data)
+        if date_response is None:
+            # This is not recorded as a day without data, so it can be scraped later
+            raise CacheMissError(f"There is no cached page for the date {date} of {city_name}")
+        self.metrics.increment("pages")
+
+        return self._get_data_from_table_by_cityname(date_response=date_response, city_name=city_name, date=date)
+
+    def refresh_single_data_from_website(self, city_name, date: datetime, page_state=None):
+        """
+        Download the page of the day again and compare it with page_state, the one of the archived version
+        (see ArchiveManifest.page_states). Return the new page state with the 'cells' of the day, that are None
+        if the bulletin did not change: the request is conditional on the HTTP validators (if ARPAV sent any),
+        and the page is parsed only if its content changed, and the cells are returned only if their values did.
+        """
+        if self.replay:
+            raise ValueError("The pages cannot be refreshed in replay mode")
+        page_state = page_state or {}
+        post_data = self._set_post_request_data(city_name=city_name, date=date)
+        headers = {}
+        if page_state.get('etag') is not None:
+            headers["If-None-Match"] = page_state['etag']
+        if page_state.get('last_modified') is not None:
+            headers["If-Modified-Since"] = page_state['last_modified']
+        with self.metrics.time_stage("fetch"):
+            date_response = self.http_session.post(self.arpav_air_data_archive_url, data=post_data,
+                                                   headers=headers or None)
+        self.metrics.increment("pages")
+        if date_response.status_code == 304:
+            return {**page_state, 'cells': None}
+        # An error page must not replace the archived bulletin
+        date_response.raise_for_status()
+
+        new_page_state = {'content_hash': hashlib.sha256(date_response.content).hexdigest(),
+                          'table_hash': page_state.get('table_hash'),
+                          'etag': date_response.headers.get("ETag"),
+                          'last_modified': date_response.headers.get("Last-Modified")}
+        if new_page_state['content_hash'] == page_state.get('content_hash'):
+            return {**new_page_state, 'cells': None}
+        if self.response_cache is not None:
+            self.response_cache.put(post_data, date_response.content, encoding=date_response.encoding)
+
+        table_cells = self._get_data_from_table_by_cityname(date_response=date_response, city_name=city_name,
+                                                            date=date)
+        new_page_state['table_hash'] = table_cells_hash(table_cells)
+        if new_page_state['table_hash'] == page_state.get('table_hash'):
+            # Only the rest of the page changed
+            return {**new_page_state, 'cells': None}
+        return {**new_page_state, 'cells': table_cells}
+
+    def retrieve_and_write_single_data_from_website(self, writer, city_name, date: datetime):
+        """ Write the values of the day with writer.writerow (e.g. a csv.DictWriter). Return 1 if there were any """
+        table_cells = self.retrieve_single_data_from_website(city_name=city_name, date=date)
+        for table_cell in table_cells:
+            writer.writerow(table_cell.as_dict())
+        self.metrics.log_event("day", city_name=city_name, date=f"{date:%Y-%m-%d}",
+                               status=ArchiveManifest.FETCHED if table_cells else ArchiveManifest.EMPTY,
+                               rows=len(table_cells))
+        return 1 if table_cells else 0
+
+    def close(self):
+        """ Close the connections of the HTTP session (the response_cache is closed by whoever opened it) """
+        if self.http_session is not None:
+            self.http_session.close()
+
+    def iter_table_cells_from_website(self, city_names, dates, max_workers=1, max_requests_per_second=None):
+        """
+        Yield the TableCells of every province and date, in date order, without writing anything.
+        Only the days in progress are kept in memory, so a multi-year scrape can be consumed as a stream.
+        """
+        fetcher = ConcurrentFetcher(fetch_day=self.retrieve_single_data_from_website, max_workers=max_workers,
+                                    max_requests_per_second=max_requests_per_second)
+        for _, _, table_cells in fetcher.fetch(city_names=city_names, dates=dates):
+            yield from table_cells
+
+
+class DataArchive:
+    """
+    Monthly archive ({year}/{month}/{year}_{month}_arpav_data.csv by default) of the values scraped from ARPAV.
+    The status of every (province, date) is stored in a manifest (see arpav_manifest.py), so that an interrupted
+    or partial scrape can be resumed by fetching only the missing days.
+    """
+
+    manifest_file_name = "arpav_manifest.sqlite"
+
+    def __init__(self, fieldnames, arpav_archives_dir, output_format="csv", sink=None, build_index=False):
+        self.fieldnames = fieldnames
+        self.arpav_archives_dir = arpav_archives_dir
+        os.makedirs(arpav_archives_dir, exist_ok=True)
+        self.manifest = ArchiveManifest(os.path.join(arpav_archives_dir, self.manifest_file_name))
+        # The cells of every month are written by the sink (see arpav_sinks.py). Any object with
+        # "append_month(year, month, cells)" and "close()" can be used instead of the ones of output_format
+        self.sink = sink if sink is not None else self._make_sink(output_format)
+        # With build_index, the query index of the CSV files (see arpav_archive_index.py) is updated with every
+        # month written
+        self.archive_index = None
+        if build_index:
+            if not isinstance(self.sink, CsvSink):
+                raise ValueError("The archive index can only be built for the CSV format")
+            self.archive_index = ArchiveIndex(arpav_archives_dir)
+            self.archive_index.update()
+
+    def _make_sink(self, output_format):
+        if output_format == "csv":
+            return CsvSink(self.arpav_archives_dir, fieldnames=self.fieldnames)
+        elif output_format == "parquet":
+            # pyarrow is only needed for this format
+            from arpav_parquet_sink import ParquetSink
+            return ParquetSink(self.arpav_archives_dir)
+        elif output_format == "matrix":
+            from arpav_matrix_sink import MatrixSink
+            return MatrixSink(self.arpav_archives_dir)
+        elif output_format == "sqlite":
+            return SqliteSink(os.path.join(self.arpav_archives_dir, "arpav_data.sqlite"))
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    def _register_existing_month(self, year, month):
+        """
+        A monthly CSV file written before the manifest existed: every (province, date) that is already in it
+        is recorded as fetched, so that it is not scraped (and appended) again.
+        """
+        if not isinstance(self.sink, CsvSink) or self.manifest.has_month(year, month):
+            return
+        arpav_file_dir = self.sink.monthly_file_path(year, month)
+        if not os.path.exists(arpav_file_dir):
+            return
+        rows_by_day = collections.Counter((row['city_name'], row['date'][:10])
+                                          for row in self.sink.read_month(year, month))
+        self.manifest.mark([(city_name, datetime.datetime.strptime(date, "%Y-%m-%d"), ArchiveManifest.FETCHED, rows)
+                            for (city_name, date), rows in rows_by_day.items()])
+        print(f"Registered {len(rows_by_day)} days already archived in {arpav_file_dir}")
+
+    def _append_month_cells(self, year, month, table_cells, manifest_entries, metrics, page_entries=None,
+                            replaced_days=None):
+        """
+        Add the cells to the monthly partition and then record the days (and their page state) in the manifest.
+        The sinks write a month atomically, so after a crash the days that are not in the manifest yet
+        are simply scraped again.
+        If replaced_days (a set of (city_name, date)) is given, the rows of those days are replaced by the cells.
+        Without page_entries, the page state of the days is the table_hash of their cells.
+        """
+        if page_entries is None:
+            cells_by_day = collections.defaultdict(list)
+            for table_cell in table_cells:
+                cells_by_day[(table_cell.city_name, table_cell.date)].append(table_cell)
+            page_entries = [(city_name, date, {'table_hash': table_cells_hash(cells_by_day[(city_name, date)])})
+                            for city_name, date, status, _ in manifest_entries
+                            if status in ArchiveManifest.DONE_STATUSES]
+        with metrics.time_stage("write"):
+            if replaced_days:
+                self.sink.replace_days(year, month, days=replaced_days, cells=table_cells)
+            elif table_cells:
+                self.sink.append_month(year, month, table_cells)
+            if (replaced_days or table_cells) and self.archive_index is not None:
+                self.archive_index.update_month(year, month)
+            self.manifest.mark(manifest_entries)
+            self.manifest.mark_pages(page_entries)
+
+    def close(self):
+        self.sink.close()
+        self.manifest.close()
+        if self.archive_index is not None:
+            self.archive_index.close()
+
+    def scrape_and_archive_data_by_year(self, starting_date: datetime.datetime, last_year:int, city_names=("Belluno",),
+                                        max_workers=1, max_requests_per_second=None, arpav_scraper=None,
+                                        metrics=None):
+        """
+        Scrape every day from starting_date to the end of the year before last_year for every province in
+        city_names (see "scrape_and_archive_data").
+        """
+        return self.scrape_and_archive_data(starting_date=starting_date, ending_date=datetime.datetime(last_year, 1, 1),
+                                            city_names=city_names, max_workers=max_workers,
+                                            max_requests_per_second=max_requests_per_second,
+                                            arpav_scraper=arpav_scraper, metrics=metrics)
+
+    def scrape_and_archive_data(self, starting_date: datetime.datetime, ending_date: datetime.datetime,
+                                city_names=("Belluno",), max_workers=1, max_requests_per_second=None,
+                                arpav_scraper=None, metrics=None):
+        """
+        Scrape every day from starting_date to ending_date (excluded) for every province in city_names, skipping the
+        days that are already in the manifest as fetched or empty.
+        The requests are spread among max_workers threads (with at most max_requests_per_second requests overall),
+        but the cells are written by the sink in date order, one month at a time.
+        arpav_scraper can be any object with a "retrieve_single_data_from_website" method (e.g. the Selenium
+        scraper or its DriverPool). By default the pages are downloaded with ArpavArchiveScraper.
+        The durations of the stages, the counters and the progress are recorded in metrics (by default the
+        ScrapeMetrics of arpav_scraper, see arpav_metrics.py).
+        """
+        if arpav_scraper is None:
+            arpav_scraper = ArpavArchiveScraper()
+        if metrics is None:
+            metrics = getattr(arpav_scraper, "metrics", None) or ScrapeMetrics()
+        fetcher = ConcurrentFetcher(fetch_day=arpav_scraper.retrieve_single_data_from_website,
+                                    max_workers=max_workers, max_requests_per_second=max_requests_per_second,
+                                    stop_on_error=False)
+        day_dates = [starting_date + datetime.timedelta(days=day_id)
+                     for day_id in range((ending_date - starting_date).days)]
+        for year, month in sorted({(day_date.year, day_date.month) for day_date in day_dates}):
+            self._register_existing_month(year, month)
+
+        statuses = self.manifest.statuses(start_date=starting_date, end_date=ending_date)
+        missing_days = [(city_name, day_date) for day_date in day_dates for city_name in city_names
+                        if not self.manifest.is_done(statuses, city_name, day_date)]
+        print(f"{len(day_dates) * len(city_names) - len(missing_days)} days are already archived, "
+              f"{len(missing_days)} days to scrape")
+        metrics.start(total_days=len(missing_days))
+
+        # The days themselves are in the day events of the metrics log
+        extracted_values, missing_values, failed_days = 0, 0, 0
+        current_month, month_cells, month_entries = None, [], []
+        try:
+            for city_name, day_date, table_cells in fetcher.fetch_grid(missing_days):
+                if (day_date.year, day_date.month) != current_month:
+                    if current_month is not None:
+                        self._append_month_cells(*current_month, table_cells=month_cells,
+                                                 manifest_entries=month_entries, metrics=metrics)
+                    current_month, month_cells, month_entries = (day_date.year, day_date.month), [], []
+
+                if table_cells is None:
+                    failed_days += 1
+                    month_entries.append((city_name, day_date, ArchiveManifest.FAILED, 0))
+                elif not table_cells:
+                    missing_values += 1
+                    month_entries.append((city_name, day_date, ArchiveManifest.EMPTY, 0))
+                else:
+                    extracted_values += 1
+                    month_cells.extend(table_cells)
+                    month_entries.append((city_name, day_date, ArchiveManifest.FETCHED, len(table_cells)))
+                metrics.day_done(*month_entries[-1])
+        finally:
+            # Also when interrupted, the days that were already retrieved are archived
+            if current_month is not None:
+                self._append_month_cells(*current_month, table_cells=month_cells, manifest_entries=month_entries,
+                                         metrics=metrics)
+            metrics.finish()
+
+        fetched_days = extracted_values + missing_values
+        print(f"Collected {extracted_values} values from {starting_date:%Y-%m-%d} to {ending_date:%Y-%m-%d}")
+        print(f"There are {missing_values} missing values from {starting_date:%Y-%m-%d} to "
+              f"{ending_date:%Y-%m-%d}.\n "
+              f"They are {missing_values / fetched_days * 100 if fetched_days else 0} % of the total values.")
+        if failed_days:
+            print(f"The retrieval failed for {failed_days} days, they will be retried by the next run.")
+        print(f"Stage durations and counters:\n{metrics.summary()}")
+        if getattr(arpav_scraper, "http_session", None) is not None:
+            print(f"HTTP requests: {arpav_scraper.http_session.latency_summary()}")
+
+        return 1
+
+    def refresh_archived_data(self, starting_date: datetime.datetime, ending_date: datetime.datetime,
+                              city_names=("Belluno",), max_workers=1, max_requests_per_second=None,
+                              arpav_scraper=None, metrics=None):
+        """
+        Download again every day from starting_date to ending_date (excluded) for every province in city_names
+        (e.g. the last 90 days, that ARPAV may still revise) and rewrite only the days whose bulletin changed,
+        and so only the monthly partitions that contain them (see
+        ArpavArchiveScraper.refresh_single_data_from_website). The days that were never archived are added.
+        Return the number of revised days.
+        """
+        if arpav_scraper is None:
+            arpav_scraper = ArpavArchiveScraper()
+        if not hasattr(arpav_scraper, "refresh_single_data_from_website"):
+            raise ValueError("The archive can only be refreshed with the HTTP scraper (ArpavArchiveScraper)")
+        if not hasattr(self.sink, "replace_days"):
+            raise ValueError(f"The days cannot be replaced in the sink {type(self.sink).__name__}")
+        if metrics is None:
+            metrics = getattr(arpav_scraper, "metrics", None) or ScrapeMetrics()
+
+        page_states = self.manifest.page_states(start_date=starting_date, end_date=ending_date)
+
+        def refresh_day(city_name, date):
+            return arpav_scraper.refresh_single_data_from_website(
+                city_name=city_name, date=date, page_state=self.manifest.page_state(page_states, city_name, date))
+
+        fetcher = ConcurrentFetcher(fetch_day=refresh_day, max_workers=max_workers,
+                                    max_requests_per_second=max_requests_per_second, stop_on_error=False,
+                                    collect_cells=False)
+        day_dates = [starting_date + datetime.timedelta(days=day_id)
+                     for day_id in range((ending_date - starting_date).days)]
+        metrics.start(total_days=len(day_dates) * len(city_names))
+
+        # The days themselves are in the day events of the metrics log
+        unchanged_days, revised_days, failed_days, rewritten_months = 0, 0, 0, []
+        current_month, month_cells, month_entries, month_pages, month_revised_days = None, [], [], [], set()
+
+        def flush_month():
+            if month_revised_days:
+                rewritten_months.append(current_month)
+            self._append_month_cells(*current_month, table_cells=month_cells, manifest_entries=month_entries,
+                                     metrics=metrics, page_entries=month_pages, replaced_days=month_revised_days)
+
+        try:
+            for city_name, day_date, refreshed_page in fetcher.fetch(city_names=city_names, dates=day_dates):
+                if (day_date.year, day_date.month) != current_month:
+                    if current_month is not None:
+                        flush_month()
+                    current_month = (day_date.year, day_date.month)
+                    month_cells, month_entries, month_pages, month_revised_days = [], [], [], set()
+
+                if refreshed_page is None:
+                    # The archived version is kept
+                    failed_days += 1
+                    metrics.day_done(city_name, day_date, ArchiveManifest.FAILED, 0)
+                    continue
+                table_cells = refreshed_page.pop('cells')
+                month_pages.append((city_name, day_date, refreshed_page))
+                if table_cells is None:
+                    unchanged_days += 1
+                    metrics.day_done(city_name, day_date, "unchanged", 0)
+                    continue
+                revised_days += 1
+                month_revised_days.add((city_name, day_date))
+                month_cells.extend(table_cells)
+                status = ArchiveManifest.FETCHED if table_cells else ArchiveManifest.EMPTY
+                month_entries.append((city_name, day_date, status, len(table_cells)))
+                metrics.day_done(*month_entries[-1])
+        finally:
+            # Also when interrupted, the days that were already retrieved are archived
+            if current_month is not None:
+                flush_month()
+            metrics.finish()
+
+        print(f"Refreshed the days from {starting_date:%Y-%m-%d} to {ending_date:%Y-%m-%d}: "
+              f"{unchanged_days} unchanged, {revised_days} revised or new, {failed_days} failed")
+        if revised_days:
+            print(f"Rewritten monthly partitions: {', '.join(f'{year}/{month}' for year, month in rewritten_months)}")
+        if failed_days:
+            print(f"The refresh failed for {failed_days} days, their archived version is kept.")
+        print(f"Stage durations and counters:\n{metrics.summary()}")
+        return revised_days
+
@@ -0,0 +1,267 @@
+"""
+Offline benchmarks of the three stages of the scraper, on bulletin pages served by a local stub server:
+- parse: pages/second of parse_bulletin_table + iter_table_cells (with and without the header schema cache)
+- write: rows/second of every sink (and of the plain csv.DictWriter used by the first versions of DataArchive)
+- end to end: days/second of DataArchive.scrape_and_archive_data with different numbers of workers
+
+By default the pages are synthetic, in the layout of the 'ariadativalidati' table (see tests/bulletin_pages.py):
+no recorded bulletin is shipped with the repository. Real pages can be exported from a page cache with
+--record-from-cache to a --fixtures directory, in the layout of arpav_stub_server.py
+({fixtures_dir}/{province}/{year}_{month}_{day}.html).
+The results are saved as JSON, and --compare reports (and exits with 1 for) the metrics that got slower than
+a previous result file of the same machine and pages.
+
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/benchmark_20200101_120000.json
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from arpav_html_parser import parse_bulletin_table  # noqa: E402
+from arpav_schema_cache import HeaderSchemaCache  # noqa: E402
+from arpav_sinks import CsvSink, MemorySink, SqliteSink  # noqa: E402
+from arpav_stub_server import recorded_page_path, start_stub_server  # noqa: E402
+from arpav_table_cells import TABLE_CELL_FIELDNAMES, iter_table_cells  # noqa: E402
+from tests.bulletin_pages import write_synthetic_fixtures  # noqa: E402
+
+def export_fixtures_from_cache(cache_dir, fixtures_dir):
+    """ Copy the pages of a ResponseCache in the layout read by the stub server """
+    from arpav_response_cache import ResponseCache
+    response_cache = ResponseCache(cache_dir)
+    exported_pages = 0
+    for city_name, date, cached_response in response_cache.iter_entries():
+        year, month, day = date.split("-")
+        page_path = recorded_page_path(fixtures_dir, city_name, year, month, day)
+        os.makedirs(os.path.dirname(page_path), exist_ok=True)
+        with open(page_path, mode="wb") as page_file:
+            page_file.write(cached_response.content)
+        exported_pages += 1
+    response_cache.close()
+    return exported_pages
+
+
+def load_fixture_pages(fixtures_dir):
+    """ Return a list of (city_name, date, html) of the recorded pages """
+    pages = []
+    for city_name in sorted(os.listdir(fixtures_dir)):
+        city_dir = os.path.join(fixtures_dir, city_name)
+        if not os.path.isdir(city_dir):
+            continue
+        for file_name in sorted(os.listdir(city_dir)):
+            if not file_name.endswith(".html"):
+                continue
+            date = datetime.datetime.strptime(file_name[:-len(".html")], "%Y_%m_%d")
+            with open(os.path.join(city_dir, file_name), mode="r", encoding="utf-8", errors="replace") as page_file:
+                pages.append((city_name, date, page_file.read()))
+    return pages
+
+
+def _best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def bench_parse(pages, repeat):
+    def parse_all(schema_cache):
+        cells = 0
+        for city_name, date, html in pages:
+            table = parse_bulletin_table(html)
+            cells += sum(1 for _ in iter_table_cells(table=table, city_name=city_name, date=date,
+                                                     schema_cache=schema_cache))
+        return cells
+
+    cells_count = parse_all(schema_cache=None)
+    without_cache = _best_time(lambda: parse_all(schema_cache=None), repeat)
+    schema_cache = HeaderSchemaCache()
+    with contextlib.redirect_stdout(None):
+        parse_all(schema_cache=schema_cache)
+    with_cache = _best_time(lambda: parse_all(schema_cache=schema_cache), repeat)
+    return {'pages': len(pages),
+            'cells': cells_count,
+            'pages_per_second': len(pages) / without_cache,
+            'schema_cache_pages_per_second': len(pages) / with_cache}
+
+
+def _parse_cells(pages):
+    cells = []
+    for city_name, date, html in pages:
+        cells.extend(iter_table_cells(table=parse_bulletin_table(html), city_name=city_name, date=date))
+    return cells
+
+
+def bench_sinks(cells, work_dir, repeat):
+    cells_by_month = {}
+    for cell in cells:
+        cells_by_month.setdefault((cell.date.year, cell.date.month), []).append(cell)
+
+    def dict_writer():
+        # The original DataArchive: one csv.DictWriter.writerow per dict
+        with open(os.path.join(work_dir, "dict_writer.csv"), mode="w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=TABLE_CELL_FIELDNAMES)
+            writer.writeheader()
+            for cell in cells:
+                writer.writerow(cell.as_dict())
+
+    def run_sink(make_sink):
+        def write():
+            sink_dir = os.path.join(work_dir, "sink")
+            shutil.rmtree(sink_dir, ignore_errors=True)
+            os.makedirs(sink_dir)
+            sink = make_sink(sink_dir)
+            for (year, month), month_cells in sorted(cells_by_month.items()):
+                sink.append_month(year, month, month_cells)
+            sink.close()
+        return write
+
+    benchmarks = {'csv.DictWriter': dict_writer,
+                  'CsvSink': run_sink(lambda sink_dir: CsvSink(sink_dir)),
+                  'SqliteSink': run_sink(lambda sink_dir: SqliteSink(os.path.join(sink_dir, "arpav_data.sqlite"))),
+                  'MemorySink': run_sink(lambda sink_dir: MemorySink())}
+    try:
+        from arpav_parquet_sink import ParquetSink
+    except ImportError:
+        pass
+    else:
+        benchmarks['ParquetSink'] = run_sink(lambda sink_dir: ParquetSink(sink_dir))
+
+    return {name: {'rows_per_second': len(cells) / _best_time(write, repeat)} for name, write in benchmarks.items()}
+
+
+def bench_end_to_end(fixtures_dir, pages, work_dir, concurrency_levels, latency):
+    try:
+        from arpav_web_scraper import ArpavArchiveScraper, DataArchive
+        import requests  # noqa: F401
+    except ImportError as e:
+        return {'skipped': f"the HTTP backend is not available ({e})"}
+
+    city_names = sorted({city_name for city_name, _, _ in pages})
+    dates = sorted({date for _, date, _ in pages})
+    starting_date, ending_date = dates[0], dates[-1] + datetime.timedelta(days=1)
+    days = (ending_date - starting_date).days * len(city_names)
+
+    stub_server, url = start_stub_server(fixtures_dir, latency=latency)
+    results = {'latency_seconds': latency, 'days': days}
+    try:
+        for max_workers in concurrency_levels:
+            archives_dir = os.path.join(work_dir, f"archive_{max_workers}")
+            shutil.rmtree(archives_dir, ignore_errors=True)
+            data_archive = DataArchive(fieldnames=TABLE_CELL_FIELDNAMES, arpav_archives_dir=archives_dir)
+            arpav_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=url)
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(None):
+                data_archive.scrape_and_archive_data(starting_date=starting_date, ending_date=ending_date,
+                                                     city_names=city_names, max_workers=max_workers,
+                                                     arpav_scraper=arpav_scraper)
+            elapsed = time.perf_counter() - start_time
+            data_archive.close()
+            arpav_scraper.close()
+            results[f"workers_{max_workers}"] = {'days_per_second': days / elapsed}
+    finally:
+        stub_server.shutdown()
+    return results
+
+
+def _flatten_metrics(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(_flatten_metrics(value, prefix=f"{prefix}{key}."))
+        elif key.endswith("per_second"):
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+
+def compare_results(results, baseline, tolerance):
+    """ Print every throughput metric against the baseline and return the ones slower than (1 - tolerance) """
+    regressions = []
+    current_metrics, baseline_metrics = _flatten_metrics(results), _flatten_metrics(baseline)
+    for name, value in sorted(current_metrics.items()):
+        if name not in baseline_metrics:
+            continue
+        ratio = value / baseline_metrics[name]
+        is_regression = ratio < 1 - tolerance
+        print(f"{'REGRESSION ' if is_regression else ''}{name}: {value:.1f} ({ratio:.2f}x of the baseline)")
+        if is_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the ARPAV scraper")
+    parser.add_argument("--fixtures", default=None, help="Recorded pages (default: synthetic pages)")
+    parser.add_argument("--record-from-cache", default=None,
+                        help="Export the pages of this ResponseCache directory to --fixtures first")
+    parser.add_argument("--synthetic-days", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=3, help="Every measure is the best of this many runs")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.02, help="Answer delay of the stub server (seconds)")
+    parser.add_argument("--output", default=None, help="JSON file of the results (default: benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slow down reported as a regression")
+    args = parser.parse_args(argv)
+    # Read before the run, since the new results may be saved in the same file
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, mode="r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    work_dir = tempfile.mkdtemp(prefix="arpav_benchmarks_")
+    try:
+        fixtures_dir = args.fixtures
+        if args.record_from_cache is not None:
+            if fixtures_dir is None:
+                parser.error("--record-from-cache needs --fixtures")
+            print(f"Exported {export_fixtures_from_cache(args.record_from_cache, fixtures_dir)} pages")
+        if fixtures_dir is None:
+            fixtures_dir = os.path.join(work_dir, "fixtures")
+            dates = [datetime.datetime(2019, 1, 1) + datetime.timedelta(days=day)
+                     for day in range(args.synthetic_days)]
+            write_synthetic_fixtures(fixtures_dir, city_names=["Belluno"], dates=dates)
+        pages = load_fixture_pages(fixtures_dir)
+        if not pages:
+            parser.error(f"There are no recorded pages in {fixtures_dir}")
+
+        results = {'created_at': datetime.datetime.now().isoformat(timespec="seconds"),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'fixtures': args.fixtures if args.fixtures is not None else "synthetic"}
+        print(f"Parsing {len(pages)} pages")
+        results['parse'] = bench_parse(pages, repeat=args.repeat)
+        print(f"Writing {results['parse']['cells']} rows")
+        results['write'] = bench_sinks(_parse_cells(pages), work_dir=work_dir, repeat=args.repeat)
+        print(f"Scraping through the stub server with {args.workers} workers")
+        results['end_to_end'] = bench_end_to_end(fixtures_dir, pages, work_dir=work_dir,
+                                                 concurrency_levels=args.workers, latency=args.latency)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output_path = args.output
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, mode="w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results saved in {output_path}")
+
+    if baseline is not None and compare_results(results, baseline, tolerance=args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
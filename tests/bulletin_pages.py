@@ -0,0 +1,57 @@
+"""
+Synthetic ARPAV bulletins, shaped like the 'ariadativalidati' table (three header rows with colspans and one row
+per station), used by the tests and by the offline benchmarks.
+"""
+import datetime
+import os
+
+from arpav_stub_server import recorded_page_path
+
+CITY_NAMES = ["Belluno", "Padova"]
+# The days with a recorded page served by the stub server: 2019-01-01 to 2019-02-14
+RECORDED_DATES = [datetime.datetime(2019, 1, 1) + datetime.timedelta(days=day_id) for day_id in range(45)]
+
+SYNTHETIC_POLLUTANTS = [("PM10", [("media giorn.", ["conc.", "sup."])]),
+                        ("PM2.5", [("media giorn.", ["conc.", "sup."])]),
+                        ("NO2", [("max ora", ["conc.", "ora", "sup."]), ("media giorn.", ["conc."])]),
+                        ("O3", [("max ora", ["conc.", "ora", "sup."]), ("max media 8 ore", ["conc.", "sup."])]),
+                        ("CO", [("max media 8 ore", ["conc."])]),
+                        ("SO2", [("max ora", ["conc.", "sup."]), ("media giorn.", ["conc."])])]
+
+
+def day(month, day_of_month):
+    return datetime.datetime(2019, month, day_of_month)
+
+
+def synthetic_bulletin_page(day_index, n_stations=12):
+    """ HTML page with an 'ariadativalidati' table shaped like the ARPAV one (three header rows, colspans) """
+    pollutant_cells, meas_info_cells, meas_unit_cells = [], [], []
+    for pollutant, measurements in SYNTHETIC_POLLUTANTS:
+        pollutant_cells.append(f"<td colspan='{sum(len(units) for _, units in measurements)}'>{pollutant}</td>")
+        for meas_info, units in measurements:
+            meas_info_cells.append(f"<td colspan='{len(units)}'><a href='#'>{meas_info}</a></td>")
+            meas_unit_cells.extend(f"<td>{unit}</td>" for unit in units)
+    n_columns = len(meas_unit_cells)
+
+    rows = ["<tr><td colspan='3'>Stazioni</td>" + "".join(pollutant_cells) + "</tr>",
+            "<tr><td colspan='3'></td>" + "".join(meas_info_cells) + "</tr>",
+            "<tr><td>Tipo</td><td>Stazione</td><td>Comune</td>" + "".join(meas_unit_cells) + "</tr>"]
+    for station in range(n_stations):
+        values = "".join(f"<td>{(day_index * 7 + station * 13 + column * 3) % 120}</td>"
+                         if (station + column + day_index) % 9 else "<td>-</td>"
+                         for column in range(n_columns))
+        rows.append(f"<tr><td>BU</td><td><strong>Stazione {station}</strong></td><td>Comune {station}</td>"
+                    f"{values}</tr>")
+    return ("<html><head><title>Dati validati</title></head><body><div id='content'>"
+            "<div id='ariadativalidati'><table><tbody>" + "\n".join(rows) + "</tbody></table></div>"
+            "</div></body></html>")
+
+
+def write_synthetic_fixtures(fixtures_dir, city_names, dates):
+    """ Write a synthetic page for every province and date in the layout read by arpav_stub_server.py """
+    for city_name in city_names:
+        for day_index, date in enumerate(dates):
+            page_path = recorded_page_path(fixtures_dir, city_name, date.year, f"{date.month:02d}", f"{date.day:02d}")
+            os.makedirs(os.path.dirname(page_path), exist_ok=True)
+            with open(page_path, mode="w") as page_file:
+                page_file.write(synthetic_bulletin_page(day_index))
@@ -0,0 +1,28 @@
+import pytest
+
+from arpav_stub_server import start_stub_server
+from arpav_web_scraper import ArpavArchiveScraper
+from tests.bulletin_pages import CITY_NAMES, RECORDED_DATES, write_synthetic_fixtures
+from tests.stub_archive import UrllibSession
+
+
+@pytest.fixture
+def recordings_dir(tmp_path):
+    recordings_dir = str(tmp_path / "recordings")
+    write_synthetic_fixtures(recordings_dir, city_names=CITY_NAMES, dates=RECORDED_DATES)
+    return recordings_dir
+
+
+@pytest.fixture
+def stub_server_url(recordings_dir):
+    server, url = start_stub_server(recordings_dir)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_scraper(stub_server_url):
+    def make_scraper():
+        return ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=UrllibSession())
+    return make_scraper
@@ -0,0 +1,92 @@
+"""
+Helpers of the tests that scrape the synthetic bulletins served by arpav_stub_server.py into a DataArchive
+"""
+import collections
+import csv
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from arpav_html_parser import parse_bulletin_table
+from arpav_stub_server import recorded_page_path
+from arpav_table_cells import TABLE_CELL_FIELDNAMES, iter_table_cells
+from arpav_web_scraper import DataArchive
+from tests.bulletin_pages import CITY_NAMES
+
+
+class UrllibResponse:
+
+    encoding = "utf-8"
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP error {self.status_code}")
+
+
+class UrllibSession:
+    """
+    The "post(url, data, headers)" of ArpavHttpSession through urllib, so that the scraper can be tested against
+    the stub server without requests. Every request is recorded in "requests" as (form data, headers, status code).
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, data, headers=None):
+        request = urllib.request.Request(url, data=urllib.parse.urlencode(data).encode(), headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as http_response:
+                response = UrllibResponse(http_response.status, http_response.read(), dict(http_response.headers))
+        except urllib.error.HTTPError as e:
+            response = UrllibResponse(e.code, e.read(), dict(e.headers))
+        self.requests.append((data, headers, response.status_code))
+        return response
+
+    def latency_summary(self):
+        return f"{len(self.requests)} requests"
+
+    def close(self):
+        pass
+
+
+def read_archive_rows(archives_dir):
+    """ Return {(year, month): rows} of the monthly CSV files """
+    months = {}
+    for year in os.listdir(archives_dir):
+        if not year.isdigit():
+            continue
+        for month in os.listdir(os.path.join(archives_dir, year)):
+            file_path = os.path.join(archives_dir, year, month, f"{year}_{month}_arpav_data.csv")
+            with open(file_path, mode="r", newline="") as csv_file:
+                months[(int(year), int(month))] = list(csv.DictReader(csv_file))
+    return months
+
+
+def rows_per_day(rows):
+    return collections.Counter((row['city_name'], row['date'][:10]) for row in rows)
+
+
+def recorded_cells_count(recordings_dir, city_name, date):
+    with open(recorded_page_path(recordings_dir, city_name, date.year, f"{date.month:02d}", f"{date.day:02d}")) as f:
+        return len(list(iter_table_cells(parse_bulletin_table(f.read()), city_name=city_name, date=date)))
+
+
+def scrape(archives_dir, arpav_scraper, starting_date, ending_date, refresh=False, **archive_options):
+    """ Scrape (or refresh) the days of CITY_NAMES into the archive and return what the DataArchive returns """
+    data_archive = DataArchive(fieldnames=TABLE_CELL_FIELDNAMES, arpav_archives_dir=archives_dir, **archive_options)
+    try:
+        scrape_days = data_archive.refresh_archived_data if refresh else data_archive.scrape_and_archive_data
+        return scrape_days(starting_date=starting_date, ending_date=ending_date, city_names=CITY_NAMES,
+                           max_workers=4, arpav_scraper=arpav_scraper)
+    finally:
+        data_archive.close()
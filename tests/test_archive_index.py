@@ -0,0 +1,73 @@
+import collections
+import math
+import os
+
+from arpav_archive_index import ArchiveIndex, _iter_csv_records
+from arpav_sinks import CsvSink
+from arpav_table_cells import TableCell
+from tests.bulletin_pages import CITY_NAMES, day
+from tests.stub_archive import read_archive_rows, scrape
+
+
+def test_csv_records_with_quoted_new_lines():
+    file_bytes = b'a,b\r\n"x\r\ny",1\r\nz,2\r\n'
+    assert [(offset, length, record) for offset, length, record in _iter_csv_records(file_bytes)] == \
+        [(0, 5, b'a,b\r\n'), (5, 10, b'"x\r\ny",1\r\n'), (15, 5, b'z,2\r\n')]
+
+
+def test_archive_index_query_reads_the_rows_of_the_series(tmp_path, make_scraper):
+    archives_dir = str(tmp_path / "archive")
+    scrape(archives_dir, make_scraper(), starting_date=day(1, 20), ending_date=day(2, 10), build_index=True)
+
+    archive_index = ArchiveIndex(archives_dir)
+    try:
+        assert archive_index.update() == 0
+        series_values = archive_index.query(station_name="Stazione 3", pollutant="NO2", meas_info="max ora",
+                                            meas_unit="conc.", start_date="2019-01-25", end_date="2019-02-05")
+    finally:
+        archive_index.close()
+
+    expected = collections.defaultdict(list)
+    for rows in read_archive_rows(archives_dir).values():
+        for row in rows:
+            if (row['station_name'], row['pollutant'], row['meas_info'], row['meas_unit']) == \
+                    ("Stazione 3", "NO2", "max ora", "conc.") and "2019-01-25" <= row['date'][:10] < "2019-02-05":
+                expected[row['city_name']].append((row['date'][:10], row['cell_value']))
+    assert all(expected[city_name] for city_name in CITY_NAMES)
+    assert sorted(values.city_name for values in series_values) == CITY_NAMES
+    for values in series_values:
+        assert [(date.isoformat(), "-" if math.isnan(value) else f"{value:g}")
+                for date, value in zip(values.dates, values.values)] == sorted(expected[values.city_name])
+
+
+
+def test_only_the_changed_months_are_indexed_again(tmp_path, make_scraper):
+    archives_dir = str(tmp_path / "archive")
+    scrape(archives_dir, make_scraper(), starting_date=day(1, 30), ending_date=day(2, 2))
+    archive_index = ArchiveIndex(archives_dir)
+    try:
+        assert archive_index.update() == 2
+        assert archive_index.update() == 0
+
+        # A day with a station with a note (quoted, with a new line) is added to February
+        csv_sink = CsvSink(archives_dir)
+        csv_sink.append_month(2019, 2, [TableCell(cell_value="7", pollutant="PM10", meas_info="media giorn.",
+                                                  meas_unit="conc.", station_name="Nuova\n\"stazione\"",
+                                                  city_name="Belluno", date=day(2, 2))])
+        assert archive_index.update() == 1
+        series_values = archive_index.query(station_name="Nuova\n\"stazione\"")
+        assert [(values.city_name, values.dates, list(values.values)) for values in series_values] == \
+            [("Belluno", [day(2, 2).date()], [7.0])]
+        # The other series of the rewritten month are still read at the right offsets
+        values = archive_index.query(station_name="Stazione 0", pollutant="PM10", meas_info="media giorn.",
+                                     meas_unit="conc.", city_name="Belluno")[0]
+        assert values.dates == [day(1, 30).date(), day(1, 31).date(), day(2, 1).date()]
+
+        # A deleted month is removed from the index
+        os.remove(csv_sink.monthly_file_path(2019, 1))
+        assert archive_index.update() == 0
+        values = archive_index.query(station_name="Stazione 0", pollutant="PM10", meas_info="media giorn.",
+                                     meas_unit="conc.", city_name="Belluno")[0]
+        assert values.dates == [day(2, 1).date()]
+    finally:
+        archive_index.close()
@@ -0,0 +1,58 @@
+import pytest
+
+import arpav_cli
+from arpav_response_cache import ResponseCache
+from arpav_stub_server import EMPTY_BULLETIN_PAGE
+from arpav_web_scraper import ArpavArchiveScraper
+from tests.bulletin_pages import day, synthetic_bulletin_page
+from tests.stub_archive import UrllibSession, read_archive_rows, rows_per_day
+
+
+class ClosingSession(UrllibSession):
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_scraper_closes_its_http_session(stub_server_url):
+    http_session = ClosingSession()
+    arpav_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=http_session)
+    assert arpav_scraper.retrieve_single_data_from_website(city_name="Belluno", date=day(1, 1))
+    arpav_scraper.close()
+    assert http_session.closed
+
+
+@pytest.mark.parametrize("argv, message", [
+    (["--backend", "replay"], "--cache-dir"),
+    (["--backend", "selenium", "--cache-dir", "cache"], "--cache-dir"),
+    (["--backend", "replay", "--cache-dir", "cache", "--refresh"], "http backend"),
+])
+def test_invalid_option_combinations_are_rejected(tmp_path, argv, message):
+    with pytest.raises(SystemExit, match=message):
+        arpav_cli.main([str(tmp_path / "archive")] + argv)
+    assert not (tmp_path / "cache").exists()
+
+
+def test_replay_backend_archives_the_cached_pages_and_closes_everything(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    response_cache = ResponseCache(cache_dir)
+    for day_index, day_of_month in enumerate((1, 2)):
+        response_cache.put({"Vai": 'Visualizza il bollettino', "provincia": "Belluno", "giorno": f"{day_of_month:02d}",
+                            "mese": "01", "anno": "2019"}, synthetic_bulletin_page(day_index).encode())
+    response_cache.put({"Vai": 'Visualizza il bollettino', "provincia": "Belluno", "giorno": "03", "mese": "01",
+                        "anno": "2019"}, EMPTY_BULLETIN_PAGE.encode())
+    response_cache.close()
+
+    closed = []
+    for closeable in (ResponseCache, ArpavArchiveScraper):
+        monkeypatch.setattr(closeable, "close", lambda self, close=closeable.close: (closed.append(type(self)),
+                                                                                      close(self)))
+    archives_dir = str(tmp_path / "archive")
+    arpav_cli.main([archives_dir, "--backend", "replay", "--cache-dir", cache_dir, "--start", "2019-01-01",
+                    "--end", "2019-01-05", "--workers", "2"])
+
+    assert sorted(closed, key=lambda closed_type: closed_type.__name__) == [ArpavArchiveScraper, ResponseCache]
+    assert sorted(rows_per_day(read_archive_rows(archives_dir)[(2019, 1)])) == [("Belluno", "2019-01-01"),
+                                                                                ("Belluno", "2019-01-02")]
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from arpav_concurrent_fetch import ConcurrentFetcher
+from tests.bulletin_pages import CITY_NAMES, day
+from tests.stub_archive import read_archive_rows, recorded_cells_count, rows_per_day, scrape
+
+
+def test_fetch_grid_yields_the_days_in_grid_order(make_scraper):
+    arpav_scraper = make_scraper()
+    grid = [(city_name, day(1, 1) + datetime.timedelta(days=day_id)) for day_id in range(10)
+            for city_name in CITY_NAMES]
+    fetcher = ConcurrentFetcher(fetch_day=arpav_scraper.retrieve_single_data_from_website, max_workers=4,
+                                max_pending=3)
+
+    results = list(fetcher.fetch_grid(grid))
+
+    assert [(city_name, date) for city_name, date, _ in results] == grid
+    for city_name, date, cells in results:
+        assert cells
+        assert {(cell.city_name, cell.date) for cell in cells} == {(city_name, date)}
+
+
+def test_fetch_grid_stop_on_error(make_scraper):
+    arpav_scraper = make_scraper()
+    failing_day = ("Padova", day(1, 3))
+
+    def fetch_day(city_name, date):
+        if (city_name, date) == failing_day:
+            raise ValueError("Broken page")
+        return arpav_scraper.retrieve_single_data_from_website(city_name=city_name, date=date)
+
+    grid = [(city_name, day(1, day_of_month)) for day_of_month in range(1, 6) for city_name in CITY_NAMES]
+    results = list(ConcurrentFetcher(fetch_day=fetch_day, max_workers=4, stop_on_error=False).fetch_grid(grid))
+    assert [(city_name, date) for city_name, date, _ in results] == grid
+    assert [(city_name, date) for city_name, date, cells in results if cells is None] == [failing_day]
+
+    with pytest.raises(ValueError):
+        list(ConcurrentFetcher(fetch_day=fetch_day, max_workers=4, stop_on_error=True).fetch_grid(grid))
+
+
+def test_rows_are_written_in_their_monthly_file(tmp_path, recordings_dir, make_scraper):
+    archives_dir = str(tmp_path / "archive")
+    # The recordings end on 2019-02-14, the following days have no table
+    scrape(archives_dir, make_scraper(), starting_date=day(1, 28), ending_date=day(2, 17))
+
+    months = read_archive_rows(archives_dir)
+    assert set(months) == {(2019, 1), (2019, 2)}
+    for (year, month), rows in months.items():
+        assert {row['date'][:7] for row in rows} == {f"{year}-{month:02d}"}
+        # The rows are sorted by date
+        assert [row['date'] for row in rows] == sorted(row['date'] for row in rows)
+
+    archived_days = rows_per_day(months[(2019, 1)] + months[(2019, 2)])
+    expected_days = {(city_name, f"{date:%Y-%m-%d}"): recorded_cells_count(recordings_dir, city_name, date)
+                     for city_name in CITY_NAMES
+                     for date in (day(1, 28) + datetime.timedelta(days=day_id) for day_id in range(18))}
+    assert archived_days == expected_days
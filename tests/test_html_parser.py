@@ -0,0 +1,76 @@
+from arpav_html_parser import parse_bulletin_table
+from arpav_table_cells import iter_table_cells
+from tests.bulletin_pages import SYNTHETIC_POLLUTANTS, day, synthetic_bulletin_page
+
+
+def bulletin_page(table_html):
+    return f"<html><body><div id='menu'><table><tr><td>Menu</td></tr></table></div>" \
+           f"<div id='ariadativalidati'>{table_html}</div></body></html>"
+
+
+def row_texts(table):
+    return [[cell['text'] for cell in row] for row in table.rows]
+
+
+def test_rows_without_tbody_are_read():
+    table = parse_bulletin_table(bulletin_page("<table><tr><td>a</td><td>b</td></tr><tr><td>c</td></tr></table>"))
+    assert row_texts(table) == [["a", "b"], ["c"]]
+
+
+def test_thead_and_tfoot_rows_are_skipped():
+    table = parse_bulletin_table(bulletin_page("<table><thead><tr><td>head</td></tr></thead>"
+                                               "<tbody><tr><td>body</td></tr></tbody>"
+                                               "<tfoot><tr><td>foot</td></tr></tfoot></table>"))
+    assert row_texts(table) == [["body"]]
+
+
+def test_unclosed_cells_and_rows_are_closed_by_the_next_ones():
+    table = parse_bulletin_table(bulletin_page("<table><tbody><tr><td>a<td>b<th>c<tr><td>d</tbody></table>"))
+    assert row_texts(table) == [["a", "b", "c"], ["d"]]
+    assert [cell['tag'] for cell in table.rows[0]] == ["td", "td", "th"]
+    # Only the <td> cells are addressed, like the xpath 'tbody/tr/td'
+    assert [cell['text'] for cell in table.row_cells(0)] == ["a", "b"]
+
+
+def test_br_is_a_line_break_of_the_cell_and_link_text():
+    table = parse_bulletin_table(bulletin_page("<table><tr><td> max <a href='#'>media<br>giorn.</a>\n  ora</td>"
+                                               "<td><strong> Belluno   città </strong> (BL)</td></tr></table>"))
+    link_cell, station_cell = table.rows[0]
+    assert link_cell['text'] == "max media\ngiorn. ora"
+    assert link_cell['link_text'] == "media\ngiorn."
+    assert station_cell['text'] == "Belluno città (BL)"
+    assert station_cell['strong_text'] == "Belluno città"
+
+
+def test_nested_tables_are_part_of_the_outer_cell_text():
+    table = parse_bulletin_table(bulletin_page("<table><tr><td>a <table><tr><td>b</td></tr></table></td>"
+                                               "<td>c</td></tr></table><table><tr><td>other</td></tr></table>"))
+    assert row_texts(table) == [["a b", "c"]]
+
+
+def test_column_indexes_follow_colspan_and_rowspan():
+    table = parse_bulletin_table(bulletin_page("<table><tr><td rowspan='2'>A</td><td colspan='2'>B</td>"
+                                               "<td rowspan='x'>C</td></tr>"
+                                               "<tr><td>D</td><td>E</td><td>F</td></tr>"
+                                               "<tr><td>G</td><td colspan='0'>H</td><td>I</td></tr></table>"))
+    assert [[cell['x'] for cell in row] for row in table.rows] == [[0, 1, 3], [1, 2, 3], [0, 1, 2]]
+
+
+def test_page_without_table_has_no_cells():
+    table = parse_bulletin_table("<html><body><div id='ariadativalidati'></div></body></html>")
+    assert table.rows == []
+    assert table.row_cells(0) == []
+    assert list(iter_table_cells(table, city_name="Belluno", date=day(1, 1))) == []
+
+
+def test_synthetic_bulletin_columns_and_stations():
+    table = parse_bulletin_table(synthetic_bulletin_page(day_index=0, n_stations=3))
+    cells = list(iter_table_cells(table, city_name="Belluno", date=day(1, 1)))
+
+    expected_columns = [(pollutant, meas_info, meas_unit) for pollutant, measurements in SYNTHETIC_POLLUTANTS
+                        for meas_info, units in measurements for meas_unit in units]
+    assert table.station_names() == ["Stazione 0", "Stazione 1", "Stazione 2"]
+    assert len(cells) == len(expected_columns) * 3
+    assert [(cell.pollutant, cell.meas_info, cell.meas_unit) for cell in cells[::3]] == expected_columns
+    assert [cell.station_name for cell in cells[:3]] == ["Stazione 0", "Stazione 1", "Stazione 2"]
+    assert cells[1].cell_value == table.cell_text(4, 3)
@@ -0,0 +1,94 @@
+import email.utils
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from arpav_http_session import ArpavHttpSession  # noqa: E402
+from arpav_web_scraper import ArpavArchiveScraper  # noqa: E402
+from tests.bulletin_pages import day  # noqa: E402
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP error {self.status_code}")
+
+
+class FakeSession:
+    """ requests.Session answering with the given responses, one per request """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def post(self, url, data, headers=None, timeout=None):
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    return sleeps
+
+
+def make_http_session(monkeypatch, responses, **options):
+    http_session = ArpavHttpSession(**options)
+    fake_session = FakeSession(responses)
+    monkeypatch.setattr(http_session, "_get_session", lambda: fake_session)
+    return http_session
+
+
+def test_too_many_requests_is_retried_after_the_retry_after_delay(monkeypatch, sleeps):
+    http_session = make_http_session(monkeypatch, [FakeResponse(429, {"Retry-After": "7"}), FakeResponse(200)],
+                                     max_retries=3, max_backoff=60.0)
+    assert http_session.post("http://arpav", data={}).status_code == 200
+    assert sleeps == [7.0]
+    assert http_session.retries == 1
+
+
+def test_retry_after_is_capped_by_max_backoff(monkeypatch, sleeps):
+    retry_date = email.utils.formatdate(time.time() + 3600, usegmt=True)
+    http_session = make_http_session(monkeypatch, [FakeResponse(429, {"Retry-After": "120"}),
+                                                   FakeResponse(503, {"Retry-After": retry_date}),
+                                                   FakeResponse(200)],
+                                     max_retries=3, max_backoff=30.0)
+    assert http_session.post("http://arpav", data={}).status_code == 200
+    assert sleeps == [30.0, 30.0]
+
+
+def test_retry_without_retry_after_uses_the_backoff(monkeypatch, sleeps):
+    http_session = make_http_session(monkeypatch, [FakeResponse(502), FakeResponse(429, {"Retry-After": "soon"}),
+                                                   FakeResponse(200)],
+                                     max_retries=3, backoff_factor=1.0, max_backoff=60.0)
+    assert http_session.post("http://arpav", data={}).status_code == 200
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0
+
+
+def test_last_retryable_status_is_raised(monkeypatch, sleeps):
+    http_session = make_http_session(monkeypatch, [FakeResponse(429), FakeResponse(429)], max_retries=1)
+    with pytest.raises(RuntimeError, match="429"):
+        http_session.post("http://arpav", data={})
+
+
+def test_other_errors_are_returned_without_retrying(monkeypatch, sleeps):
+    http_session = make_http_session(monkeypatch, [FakeResponse(404)], max_retries=3)
+    assert http_session.post("http://arpav", data={}).status_code == 404
+    assert sleeps == []
+
+
+def test_http_session_against_the_stub_server(stub_server_url):
+    http_session = ArpavHttpSession(max_retries=0)
+    arpav_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=http_session)
+    try:
+        assert arpav_scraper.retrieve_single_data_from_website(city_name="Belluno", date=day(1, 2))
+        assert arpav_scraper.retrieve_single_data_from_website(city_name="Belluno", date=day(3, 1)) == []
+    finally:
+        http_session.close()
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from arpav_manifest import ArchiveManifest
+from arpav_table_cells import TABLE_CELL_FIELDNAMES
+from arpav_web_scraper import ArpavArchiveScraper, DataArchive
+from tests.bulletin_pages import CITY_NAMES, day
+from tests.stub_archive import UrllibResponse, UrllibSession, read_archive_rows, rows_per_day, scrape
+
+
+class ThrottledSession(UrllibSession):
+    """ Answer 429 Too Many Requests (after the retries of the session) to the requests of throttled_days """
+
+    def __init__(self, throttled_days):
+        super().__init__()
+        self.throttled_days = throttled_days
+
+    def post(self, url, data, headers=None):
+        if (data['provincia'], int(data['giorno'])) in self.throttled_days:
+            self.requests.append((data, headers, 429))
+            return UrllibResponse(429, b"<html><body>Too Many Requests</body></html>", {})
+        return super().post(url, data, headers=headers)
+
+
+def manifest_statuses(archives_dir, starting_date, ending_date):
+    manifest = ArchiveManifest(os.path.join(archives_dir, DataArchive.manifest_file_name))
+    try:
+        return manifest.statuses(start_date=starting_date, end_date=ending_date)
+    finally:
+        manifest.close()
+
+
+def test_manifest_statuses():
+    manifest = ArchiveManifest(":memory:")
+    manifest.mark([("Belluno", day(1, 1), ArchiveManifest.FETCHED, 10),
+                   ("Belluno", day(1, 2), ArchiveManifest.EMPTY, 0),
+                   ("Padova", day(1, 1), ArchiveManifest.FAILED, 0),
+                   ("Padova", day(2, 1), ArchiveManifest.FETCHED, 3)])
+    manifest.mark([("Padova", day(1, 1), ArchiveManifest.FETCHED, 10)])
+
+    statuses = manifest.statuses(start_date=day(1, 1), end_date=day(2, 1))
+    assert statuses == {("Belluno", "2019-01-01"): "fetched", ("Belluno", "2019-01-02"): "empty",
+                        ("Padova", "2019-01-01"): "fetched"}
+    assert manifest.is_done(statuses, "Belluno", day(1, 2))
+    assert not manifest.is_done(statuses, "Belluno", day(1, 3))
+    assert manifest.has_month(2019, 2) and not manifest.has_month(2019, 3)
+    manifest.close()
+
+
+def test_scrape_resumes_from_the_manifest(tmp_path, make_scraper):
+    archives_dir = str(tmp_path / "archive")
+    scrape(archives_dir, make_scraper(), starting_date=day(1, 1), ending_date=day(1, 4))
+
+    # Crash after the month file is written and before the manifest is updated
+    data_archive = DataArchive(fieldnames=TABLE_CELL_FIELDNAMES, arpav_archives_dir=archives_dir)
+
+    def crash(entries):
+        raise KeyboardInterrupt
+
+    data_archive.manifest.mark = crash
+    with pytest.raises(KeyboardInterrupt):
+        data_archive.scrape_and_archive_data(starting_date=day(1, 4), ending_date=day(1, 6), city_names=CITY_NAMES,
+                                             max_workers=4, arpav_scraper=make_scraper())
+    data_archive.close()
+
+    arpav_scraper = make_scraper()
+    scrape(archives_dir, arpav_scraper, starting_date=day(1, 1), ending_date=day(1, 8))
+
+    # Only the days that are not in the manifest are requested, and none of them is archived twice
+    requested_days = sorted((data['provincia'], int(data['giorno']))
+                            for data, _, _ in arpav_scraper.http_session.requests)
+    assert requested_days == sorted((city_name, day_of_month) for city_name in CITY_NAMES
+                                    for day_of_month in range(4, 8))
+    archived_days = rows_per_day(read_archive_rows(archives_dir)[(2019, 1)])
+    assert len(archived_days) == 7 * len(CITY_NAMES)
+    assert len(set(archived_days.values())) == 1
+
+
+def test_error_pages_fail_the_day_and_are_scraped_again(tmp_path, stub_server_url):
+    archives_dir = str(tmp_path / "archive")
+    throttled_days = {("Belluno", 2), ("Padova", 3)}
+    throttled_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url,
+                                            http_session=ThrottledSession(throttled_days))
+    scrape(archives_dir, throttled_scraper, starting_date=day(1, 1), ending_date=day(1, 5))
+
+    statuses = manifest_statuses(archives_dir, starting_date=day(1, 1), ending_date=day(1, 5))
+    assert {(city_name, int(date[8:])) for (city_name, date), status in statuses.items()
+            if status == ArchiveManifest.FAILED} == throttled_days
+    assert ArchiveManifest.EMPTY not in statuses.values()
+
+    # The next run fetches only the failed days
+    arpav_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=UrllibSession())
+    scrape(archives_dir, arpav_scraper, starting_date=day(1, 1), ending_date=day(1, 5))
+    assert sorted((data['provincia'], int(data['giorno'])) for data, _, _ in arpav_scraper.http_session.requests) == \
+        sorted(throttled_days)
+    assert set(manifest_statuses(archives_dir, starting_date=day(1, 1), ending_date=day(1, 5)).values()) == \
+        {ArchiveManifest.FETCHED}
+    assert len(rows_per_day(read_archive_rows(archives_dir)[(2019, 1)])) == 4 * len(CITY_NAMES)
+
+
+def test_days_without_table_are_empty_and_not_scraped_again(tmp_path, make_scraper):
+    archives_dir = str(tmp_path / "archive")
+    # The recorded pages end on 2019-02-14
+    scrape(archives_dir, make_scraper(), starting_date=day(2, 14), ending_date=day(2, 17))
+
+    statuses = manifest_statuses(archives_dir, starting_date=day(2, 14), ending_date=day(2, 17))
+    assert statuses == {(city_name, f"2019-02-{day_of_month}"): (ArchiveManifest.FETCHED if day_of_month == 14
+                                                                  else ArchiveManifest.EMPTY)
+                        for city_name in CITY_NAMES for day_of_month in (14, 15, 16)}
+    arpav_scraper = make_scraper()
+    scrape(archives_dir, arpav_scraper, starting_date=day(2, 14), ending_date=day(2, 17))
+    assert arpav_scraper.http_session.requests == []
@@ -0,0 +1,128 @@
+import json
+import math
+import os
+
+from arpav_matrix_sink import MatrixSink
+from arpav_table_cells import TableCell
+from tests.bulletin_pages import day
+
+
+def make_cells(city_name, date, values, pollutant="PM10"):
+    return [TableCell(cell_value=value, pollutant=pollutant, meas_info="media giorn.", meas_unit="conc.",
+                      station_name=f"Stazione {station}", city_name=city_name, date=date)
+            for station, value in enumerate(values)]
+
+
+def read_matrix(archives_dir):
+    """ Return (labels, {(date offset, station, variable): value}) read through the sidecar, NaN excluded """
+    with open(os.path.join(archives_dir, MatrixSink.labels_file_name), mode="r") as labels_file:
+        labels = json.load(labels_file)
+    with open(os.path.join(archives_dir, labels['data_file']), mode="rb") as data_file:
+        values = MatrixSink._from_little_endian_bytes(data_file.read())
+    days, station_count, variable_count = labels['shape']
+    assert len(values) == days * station_count * variable_count
+    matrix = {}
+    for index, value in enumerate(values):
+        if not math.isnan(value):
+            day_index, rest = divmod(index, station_count * variable_count)
+            station_index, variable_index = divmod(rest, variable_count)
+            matrix[(day_index, tuple(labels['stations'][station_index]),
+                    tuple(labels['variables'][variable_index]))] = value
+    return labels, matrix
+
+
+def data_files(archives_dir):
+    return sorted(name for name in os.listdir(archives_dir) if name.endswith(".f8"))
+
+
+PM10 = ("PM10", "media giorn.", "conc.")
+NO2 = ("NO2", "media giorn.", "conc.")
+
+
+def test_days_are_written_with_nan_for_the_missing_values(tmp_path):
+    archives_dir = str(tmp_path)
+    matrix_sink = MatrixSink(archives_dir)
+    matrix_sink.append_month(2019, 1, make_cells("Belluno", day(1, 3), ["12", "-"]) +
+                             make_cells("Belluno", day(1, 1), ["10", "11"]))
+    labels, matrix = read_matrix(archives_dir)
+    assert labels['start_date'] == "2019-01-01"
+    assert labels['shape'] == [3, 2, 1]
+    assert matrix == {(0, ("Belluno", "Stazione 0"), PM10): 10.0, (0, ("Belluno", "Stazione 1"), PM10): 11.0,
+                      (2, ("Belluno", "Stazione 0"), PM10): 12.0}
+    assert data_files(archives_dir) == [labels['data_file']]
+
+
+def test_replacing_a_province_keeps_the_others(tmp_path):
+    archives_dir = str(tmp_path)
+    matrix_sink = MatrixSink(archives_dir)
+    matrix_sink.append_month(2019, 1, make_cells("Belluno", day(1, 1), ["10", "11"]) +
+                             make_cells("Padova", day(1, 1), ["20", "21"]))
+    MatrixSink(archives_dir).replace_days(2019, 1, days={("Belluno", day(1, 1))},
+                                          cells=make_cells("Belluno", day(1, 1), ["15"]))
+    _, matrix = read_matrix(archives_dir)
+    assert matrix == {(0, ("Belluno", "Stazione 0"), PM10): 15.0, (0, ("Padova", "Stazione 0"), PM10): 20.0,
+                      (0, ("Padova", "Stazione 1"), PM10): 21.0}
+
+
+def test_new_stations_variables_and_earlier_days_are_written_to_a_new_data_file(tmp_path):
+    archives_dir = str(tmp_path)
+    MatrixSink(archives_dir).append_month(2019, 1, make_cells("Belluno", day(1, 2), ["10"]))
+    old_labels, _ = read_matrix(archives_dir)
+
+    matrix_sink = MatrixSink(archives_dir)
+    matrix_sink.append_month(2019, 1, make_cells("Belluno", day(1, 1), ["20", "21"], pollutant="NO2"))
+    labels, matrix = read_matrix(archives_dir)
+    assert labels['data_file'] != old_labels['data_file']
+    assert data_files(archives_dir) == [labels['data_file']]
+    assert labels['start_date'] == "2019-01-01"
+    assert labels['stations'] == [["Belluno", "Stazione 0"], ["Belluno", "Stazione 1"]]
+    assert labels['variables'] == [list(PM10), list(NO2)]
+    assert matrix == {(1, ("Belluno", "Stazione 0"), PM10): 10.0, (0, ("Belluno", "Stazione 0"), NO2): 20.0,
+                      (0, ("Belluno", "Stazione 1"), NO2): 21.0}
+
+
+def test_a_crash_before_the_sidecar_is_written_keeps_the_archived_matrix(tmp_path, monkeypatch):
+    archives_dir = str(tmp_path)
+    MatrixSink(archives_dir).append_month(2019, 1, make_cells("Belluno", day(1, 1), ["10"]))
+    archived_labels, archived_matrix = read_matrix(archives_dir)
+
+    def crash():
+        raise KeyboardInterrupt()
+
+    # A new station (the data file is rewritten) and a later day (the data file grows)
+    for cells in (make_cells("Belluno", day(1, 1), ["10", "11"]), make_cells("Belluno", day(1, 5), ["12"])):
+        matrix_sink = MatrixSink(archives_dir)
+        monkeypatch.setattr(matrix_sink, "_write_labels", crash)
+        try:
+            matrix_sink.append_month(2019, 1, cells)
+        except KeyboardInterrupt:
+            pass
+        assert MatrixSink(archives_dir).shape == (1, 1, 1)
+        assert read_matrix(archives_dir) == (archived_labels, archived_matrix)
+
+    # The next write starts again from the archived matrix
+    MatrixSink(archives_dir).append_month(2019, 1, make_cells("Belluno", day(1, 2), ["13", "14"]))
+    labels, matrix = read_matrix(archives_dir)
+    assert labels['shape'] == [2, 2, 1]
+    assert data_files(archives_dir) == [labels['data_file']]
+    assert matrix == {(0, ("Belluno", "Stazione 0"), PM10): 10.0, (1, ("Belluno", "Stazione 0"), PM10): 13.0,
+                      (1, ("Belluno", "Stazione 1"), PM10): 14.0}
+
+
+def test_the_first_version_of_the_sidecar_reads_arpav_matrix_f8(tmp_path):
+    archives_dir = str(tmp_path)
+    MatrixSink(archives_dir).append_month(2019, 1, make_cells("Belluno", day(1, 1), ["10"]))
+    labels_path = os.path.join(archives_dir, MatrixSink.labels_file_name)
+    with open(labels_path, mode="r") as labels_file:
+        labels = json.load(labels_file)
+    os.replace(os.path.join(archives_dir, labels.pop('data_file')),
+               os.path.join(archives_dir, MatrixSink.data_file_name))
+    del labels['data_version']
+    with open(labels_path, mode="w") as labels_file:
+        json.dump(labels, labels_file)
+
+    MatrixSink(archives_dir).append_month(2019, 1, make_cells("Belluno", day(1, 2), ["11", "12"]))
+    labels, matrix = read_matrix(archives_dir)
+    assert data_files(archives_dir) == [labels['data_file']]
+    assert matrix == {(0, ("Belluno", "Stazione 0"), PM10): 10.0, (1, ("Belluno", "Stazione 0"), PM10): 11.0,
+                      (1, ("Belluno", "Stazione 1"), PM10): 12.0}
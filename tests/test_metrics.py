@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+
+import pytest
+
+from arpav_metrics import LatencyHistogram, ScrapeMetrics
+from arpav_web_scraper import ArpavArchiveScraper
+from tests.bulletin_pages import CITY_NAMES, day
+from tests.stub_archive import UrllibSession, scrape
+
+
+def read_events(log_path):
+    with open(log_path) as log_file:
+        return [json.loads(line) for line in log_file]
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = LatencyHistogram()
+    for seconds in (0.001, 0.002, 0.02, 0.02, 0.3, 100.0):
+        histogram.observe(seconds)
+    assert histogram.count == 6
+    assert histogram.sum == pytest.approx(100.343)
+    assert histogram.bucket_counts[0] == 1 and histogram.bucket_counts[-1] == 1
+    assert histogram.quantile(0.5) == 0.025
+    assert histogram.quantile(1.0) == 100.0
+    assert LatencyHistogram().quantile(0.5) == 0.0
+    assert LatencyHistogram().summary() == "-"
+
+
+def test_metrics_text_and_log(tmp_path):
+    log_path, metrics_path = str(tmp_path / "scrape.jsonl"), str(tmp_path / "arpav.prom")
+    metrics = ScrapeMetrics(log_path=log_path, metrics_path=metrics_path, progress_interval=3600)
+    metrics.start(total_days=3)
+    with metrics.time_stage("fetch"):
+        pass
+    metrics.increment("retries", 2)
+    metrics.day_done("Belluno", day(1, 1), "fetched", rows=10)
+    metrics.day_done("Belluno", day(1, 2), "empty", rows=0)
+    metrics.finish()
+
+    assert metrics.counts['fetched_days'] == 1 and metrics.counts['empty_days'] == 1
+    assert metrics.counts['rows'] == 10 and metrics.counts['retries'] == 2
+    assert [event['event'] for event in read_events(log_path)] == ["start", "day", "day", "finish"]
+    assert read_events(log_path)[1]['date'] == "2019-01-01"
+    with open(metrics_path) as metrics_file:
+        metrics_lines = metrics_file.read().splitlines()
+    assert 'arpav_stage_seconds_count{stage="fetch"} 1' in metrics_lines
+    assert 'arpav_stage_seconds_bucket{stage="write",le="+Inf"} 0' in metrics_lines
+    assert "arpav_retries_total 2" in metrics_lines
+    assert "arpav_days_to_scrape 1" in metrics_lines
+    assert not (tmp_path / "arpav.prom.tmp").exists()
+
+
+def test_scrape_logs_the_days_and_prints_only_counts(tmp_path, stub_server_url, capsys):
+    log_path = str(tmp_path / "scrape.jsonl")
+    metrics = ScrapeMetrics(log_path=log_path, progress_interval=3600)
+    arpav_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=UrllibSession(),
+                                        metrics=metrics)
+    # The recorded pages end on 2019-02-14, the 15th has no data
+    scrape(str(tmp_path / "archive"), arpav_scraper, starting_date=day(2, 13), ending_date=day(2, 16))
+
+    day_events = [event for event in read_events(log_path) if event['event'] == "day"]
+    assert sorted((event['city_name'], event['date'], event['status']) for event in day_events) == \
+        sorted((city_name, f"2019-02-{day_of_month}", "empty" if day_of_month == 15 else "fetched")
+               for city_name in CITY_NAMES for day_of_month in (13, 14, 15))
+    assert metrics.counts['pages'] == 6 and metrics.counts['empty_days'] == 2
+    assert metrics.histograms['fetch'].count == 6 and metrics.histograms['write'].count == 1
+    output = capsys.readouterr().out
+    assert "There are 2 missing values" in output
+    # Neither the days nor their lists are printed
+    assert "datetime.datetime" not in output and "2019-02-15" not in output
+
+
+def test_written_days_are_logged_instead_of_printed(tmp_path, stub_server_url, capsys):
+    log_path = str(tmp_path / "scrape.jsonl")
+    arpav_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=UrllibSession(),
+                                        metrics=ScrapeMetrics(log_path=log_path))
+    writer = csv.DictWriter(io.StringIO(), fieldnames=["cell_value", "pollutant", "meas_info", "meas_unit",
+                                                       "station_name", "city_name", "date"])
+    assert arpav_scraper.retrieve_and_write_single_data_from_website(writer, city_name="Belluno", date=day(1, 1)) == 1
+    assert arpav_scraper.retrieve_and_write_single_data_from_website(writer, city_name="Belluno", date=day(3, 1)) == 0
+
+    output = capsys.readouterr().out
+    assert "Done extracting" not in output and "There is no air pollution" not in output
+    assert [(event['date'], event['status']) for event in read_events(log_path)] == [("2019-01-01", "fetched"),
+                                                                                   ("2019-03-01", "empty")]
@@ -0,0 +1,38 @@
+import os
+
+from arpav_stub_server import recorded_page_path
+from tests.bulletin_pages import day, synthetic_bulletin_page
+from tests.stub_archive import read_archive_rows, recorded_cells_count, rows_per_day, scrape
+
+
+def test_refresh_uses_the_etag_and_replaces_only_revised_days(tmp_path, recordings_dir, make_scraper):
+    archives_dir = str(tmp_path / "archive")
+    scrape(archives_dir, make_scraper(), starting_date=day(1, 30), ending_date=day(2, 3))
+    january_file = os.path.join(archives_dir, "2019", "1", "2019_1_arpav_data.csv")
+
+    # The first refresh has no validators yet: the pages are parsed, but their table did not change
+    assert scrape(archives_dir, make_scraper(), starting_date=day(1, 30), ending_date=day(2, 3), refresh=True) == 0
+    january_mtime = os.stat(january_file).st_mtime_ns
+
+    # Then every request is conditional and the stub server answers 304
+    arpav_scraper = make_scraper()
+    assert scrape(archives_dir, arpav_scraper, starting_date=day(1, 30), ending_date=day(2, 3), refresh=True) == 0
+    assert {status_code for _, _, status_code in arpav_scraper.http_session.requests} == {304}
+    assert all(headers and "If-None-Match" in headers for _, headers, _ in arpav_scraper.http_session.requests)
+
+    # A revised bulletin and a withdrawn one
+    with open(recorded_page_path(recordings_dir, "Padova", 2019, "02", "01"), mode="w") as page_file:
+        page_file.write(synthetic_bulletin_page(day_index=999, n_stations=5))
+    os.remove(recorded_page_path(recordings_dir, "Belluno", 2019, "02", "02"))
+    old_rows = rows_per_day(read_archive_rows(archives_dir)[(2019, 2)])
+
+    assert scrape(archives_dir, make_scraper(), starting_date=day(1, 30), ending_date=day(2, 3), refresh=True) == 2
+    new_rows = rows_per_day(read_archive_rows(archives_dir)[(2019, 2)])
+    assert new_rows[("Padova", "2019-02-01")] == recorded_cells_count(recordings_dir, "Padova", day(2, 1))
+    assert new_rows[("Padova", "2019-02-01")] != old_rows[("Padova", "2019-02-01")]
+    assert ("Belluno", "2019-02-02") not in new_rows
+    assert {key: rows for key, rows in new_rows.items() if key[0] != "Padova" or key[1] != "2019-02-01"} == \
+        {key: rows for key, rows in old_rows.items() if key not in (("Padova", "2019-02-01"),
+                                                                      ("Belluno", "2019-02-02"))}
+    # The month without revisions is not rewritten
+    assert os.stat(january_file).st_mtime_ns == january_mtime
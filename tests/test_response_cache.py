@@ -0,0 +1,147 @@
+import itertools
+import os
+import sqlite3
+
+import pytest
+
+import arpav_response_cache
+from arpav_response_cache import CacheMissError, ResponseCache
+from arpav_stub_server import EMPTY_BULLETIN_PAGE
+from arpav_web_scraper import ArpavArchiveScraper
+from tests.bulletin_pages import CITY_NAMES, day, synthetic_bulletin_page
+from tests.stub_archive import UrllibSession, read_archive_rows, scrape
+
+
+def form_data(city_name, date):
+    return {"Vai": 'Visualizza il bollettino', "provincia": city_name, "giorno": f"{date.day:02d}",
+            "mese": f"{date.month:02d}", "anno": str(date.year)}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Every call of time.time() in the cache returns the next second """
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(arpav_response_cache.time, "time", lambda: float(next(ticks)))
+
+
+def last_accesses(cache_dir):
+    with sqlite3.connect(os.path.join(cache_dir, "index.sqlite")) as connection:
+        return dict(connection.execute("SELECT date, last_access FROM responses"))
+
+
+def test_identical_pages_are_stored_once(tmp_path):
+    response_cache = ResponseCache(str(tmp_path))
+    for day_of_month in range(1, 4):
+        response_cache.put(form_data("Belluno", day(1, day_of_month)), EMPTY_BULLETIN_PAGE.encode(), encoding="utf-8")
+    page = synthetic_bulletin_page(day_index=1).encode()
+    response_cache.put(form_data("Belluno", day(1, 4)), page, encoding="utf-8")
+
+    cached_response = response_cache.get(form_data("Belluno", day(1, 4)))
+    assert cached_response.content == page
+    assert cached_response.text == page.decode()
+    assert response_cache.get(form_data("Belluno", day(1, 5))) is None
+    assert len([name for _, _, names in os.walk(response_cache.objects_dir) for name in names]) == 2
+    assert [(city_name, date) for city_name, date, _ in response_cache.iter_entries()] == \
+        [("Belluno", f"2019-01-0{day_of_month}") for day_of_month in range(1, 5)]
+    response_cache.close()
+
+
+def test_page_stored_again_replaces_the_old_object(tmp_path):
+    response_cache = ResponseCache(str(tmp_path))
+    response_cache.put(form_data("Belluno", day(1, 1)), synthetic_bulletin_page(day_index=1).encode())
+    response_cache.put(form_data("Belluno", day(1, 1)), EMPTY_BULLETIN_PAGE.encode())
+
+    assert response_cache.get(form_data("Belluno", day(1, 1))).content == EMPTY_BULLETIN_PAGE.encode()
+    object_sizes = [os.path.getsize(os.path.join(directory, name))
+                    for directory, _, names in os.walk(response_cache.objects_dir) for name in names]
+    assert response_cache.size_bytes() == sum(object_sizes)
+    assert len(object_sizes) == 1
+    response_cache.close()
+
+
+def test_reads_do_not_write_the_index_without_size_limit(tmp_path, clock):
+    cache_dir = str(tmp_path)
+    response_cache = ResponseCache(cache_dir)
+    response_cache.put(form_data("Belluno", day(1, 1)), EMPTY_BULLETIN_PAGE.encode())
+    stored_accesses = last_accesses(cache_dir)
+    for _ in range(3):
+        assert response_cache.get(form_data("Belluno", day(1, 1))) is not None
+    response_cache.close()
+    assert last_accesses(cache_dir) == stored_accesses
+
+
+def test_reads_are_written_in_batches_with_size_limit(tmp_path, clock):
+    cache_dir = str(tmp_path)
+    response_cache = ResponseCache(cache_dir, max_size_bytes=10 ** 9)
+    response_cache.batch_size = 2
+    for day_of_month in (1, 2, 3):
+        response_cache.put(form_data("Belluno", day(1, day_of_month)), EMPTY_BULLETIN_PAGE.encode())
+    stored_accesses = last_accesses(cache_dir)
+
+    response_cache.get(form_data("Belluno", day(1, 1)))
+    assert last_accesses(cache_dir) == stored_accesses
+    response_cache.get(form_data("Belluno", day(1, 2)))
+    assert last_accesses(cache_dir)["2019-01-01"] > stored_accesses["2019-01-01"]
+    response_cache.get(form_data("Belluno", day(1, 3)))
+    assert last_accesses(cache_dir)["2019-01-03"] == stored_accesses["2019-01-03"]
+    response_cache.close()
+    assert last_accesses(cache_dir)["2019-01-03"] > stored_accesses["2019-01-03"]
+
+
+def test_eviction_removes_whole_pages_in_lru_order(tmp_path, clock):
+    response_cache = ResponseCache(str(tmp_path), max_size_bytes=10 ** 9)
+    response_cache.batch_size = 2
+    # Five days without data share the same page, the oldest ones are older than the other pages
+    for day_of_month in range(1, 6):
+        response_cache.put(form_data("Belluno", day(1, day_of_month)), EMPTY_BULLETIN_PAGE.encode())
+    for day_of_month in (6, 7):
+        response_cache.put(form_data("Belluno", day(1, day_of_month)), os.urandom(2000))
+    # The page without data is read again, so it is more recent than the page of the 6th
+    response_cache.get(form_data("Belluno", day(1, 1)))
+
+    response_cache.max_size_bytes = response_cache.size_bytes() + 100
+    response_cache.put(form_data("Belluno", day(1, 8)), os.urandom(2000))
+
+    assert response_cache.get(form_data("Belluno", day(1, 6))) is None
+    for day_of_month in (1, 2, 3, 4, 5, 7, 8):
+        assert response_cache.get(form_data("Belluno", day(1, day_of_month))) is not None
+    assert response_cache.size_bytes() <= response_cache.max_size_bytes
+    object_sizes = [os.path.getsize(os.path.join(directory, name))
+                    for directory, _, names in os.walk(response_cache.objects_dir) for name in names]
+    assert response_cache.size_bytes() == sum(object_sizes)
+    response_cache.close()
+
+
+def test_replay_rebuilds_the_archive_from_the_cache(tmp_path, stub_server_url):
+    response_cache = ResponseCache(str(tmp_path / "cache"))
+    recording_scraper = ArpavArchiveScraper(arpav_air_data_archive_url=stub_server_url, http_session=UrllibSession(),
+                                            response_cache=response_cache)
+    scrape(str(tmp_path / "archive"), recording_scraper, starting_date=day(1, 30), ending_date=day(2, 2))
+
+    replay_scraper = ArpavArchiveScraper(response_cache=response_cache, replay=True)
+    assert replay_scraper.http_session is None
+    scrape(str(tmp_path / "replayed"), replay_scraper, starting_date=day(1, 30), ending_date=day(2, 3))
+    assert read_archive_rows(str(tmp_path / "replayed")) == read_archive_rows(str(tmp_path / "archive"))
+
+    # A day that is not in the cache fails, and it is not recorded as a day without data
+    with pytest.raises(CacheMissError):
+        replay_scraper.retrieve_single_data_from_website(city_name=CITY_NAMES[0], date=day(2, 2))
+    response_cache.close()
+
+
+def test_cache_of_the_previous_layout_gets_the_page_accesses(tmp_path):
+    cache_dir = str(tmp_path)
+    response_cache = ResponseCache(cache_dir)
+    response_cache.put(form_data("Belluno", day(1, 1)), EMPTY_BULLETIN_PAGE.encode())
+    response_cache.close()
+    with sqlite3.connect(os.path.join(cache_dir, "index.sqlite")) as connection:
+        connection.execute("DROP INDEX objects_last_access")
+        connection.execute("CREATE TABLE old_objects AS SELECT content_hash, size FROM objects")
+        connection.execute("DROP TABLE objects")
+        connection.execute("ALTER TABLE old_objects RENAME TO objects")
+
+    response_cache = ResponseCache(cache_dir, max_size_bytes=10 ** 9)
+    assert response_cache._connection.execute("SELECT last_access FROM objects").fetchone()[0] == \
+        last_accesses(cache_dir)["2019-01-01"]
+    assert response_cache.get(form_data("Belluno", day(1, 1))).content == EMPTY_BULLETIN_PAGE.encode()
+    response_cache.close()
@@ -0,0 +1,58 @@
+import json
+
+from arpav_html_parser import parse_bulletin_table
+from arpav_schema_cache import HeaderSchemaCache, header_fingerprint
+from arpav_table_cells import iter_table_cells, link_table_columns
+from tests.bulletin_pages import day, synthetic_bulletin_page
+
+
+def changed_layout_page():
+    """ A synthetic bulletin whose second pollutant was renamed """
+    return synthetic_bulletin_page(day_index=0).replace(">PM2.5<", ">PM2,5<")
+
+
+def test_header_layout_is_linked_once(tmp_path, capsys):
+    schema_cache = HeaderSchemaCache()
+    for day_index in range(3):
+        table = parse_bulletin_table(synthetic_bulletin_page(day_index))
+        data_columns = schema_cache.get_data_columns(table, city_name="Belluno", date=day(1, day_index + 1))
+        assert data_columns == link_table_columns(table)
+    assert (schema_cache.hits, schema_cache.misses) == (2, 1)
+    assert [version['version'] for version in schema_cache.versions] == [1]
+    assert "schema version 1" in capsys.readouterr().out
+
+
+def test_cached_columns_give_the_same_cells():
+    schema_cache = HeaderSchemaCache()
+    for day_index in range(2):
+        table = parse_bulletin_table(synthetic_bulletin_page(day_index))
+        cached_cells = list(iter_table_cells(table, city_name="Belluno", date=day(1, 1), schema_cache=schema_cache))
+        cells = list(iter_table_cells(table, city_name="Belluno", date=day(1, 1)))
+        assert [cell.as_dict() for cell in cached_cells] == [cell.as_dict() for cell in cells]
+
+
+def test_new_layouts_are_logged_and_reloaded(tmp_path):
+    log_path = str(tmp_path / "arpav_schema_versions.jsonl")
+    first_table = parse_bulletin_table(synthetic_bulletin_page(day_index=0))
+    changed_table = parse_bulletin_table(changed_layout_page())
+    assert header_fingerprint(first_table) != header_fingerprint(changed_table)
+
+    schema_cache = HeaderSchemaCache(log_path=log_path)
+    schema_cache.get_data_columns(first_table, city_name="Belluno", date=day(1, 1))
+    schema_cache.get_data_columns(changed_table, city_name="Padova", date=day(1, 2))
+    with open(log_path) as log_file:
+        versions = [json.loads(line) for line in log_file]
+    assert [(version['version'], version['city_name'], version['first_date']) for version in versions] == \
+        [(1, "Belluno", str(day(1, 1))), (2, "Padova", str(day(1, 2)))]
+    assert ["PM2,5" in {pollutant for pollutant, _, _ in version['columns']} for version in versions] == \
+        [False, True]
+
+    # The next run knows both layouts already, and a new one gets the next version
+    reloaded_cache = HeaderSchemaCache(log_path=log_path)
+    assert reloaded_cache.get_data_columns(changed_table, city_name="Padova", date=day(1, 3)) == \
+        link_table_columns(changed_table)
+    assert (reloaded_cache.hits, reloaded_cache.misses) == (1, 0)
+    third_table = parse_bulletin_table(synthetic_bulletin_page(day_index=0).replace(">CO<", ">Monossido<"))
+    reloaded_cache.get_data_columns(third_table, city_name="Belluno", date=day(1, 4))
+    with open(log_path) as log_file:
+        assert [json.loads(line)['version'] for line in log_file] == [1, 2, 3]
@@ -0,0 +1,128 @@
+import datetime
+import math
+import sqlite3
+
+import pytest
+
+from arpav_sinks import CsvSink, MemorySink, SqliteSink
+from arpav_table_cells import TABLE_CELL_FIELDNAMES, TableCell, parse_cell_value, parse_date
+from tests.bulletin_pages import CITY_NAMES, day
+
+
+def make_cells(city_name, date, values):
+    return [TableCell(cell_value=value, pollutant="PM10", meas_info="media giorn.", meas_unit="conc.",
+                      station_name=f"Stazione {station}", city_name=city_name, date=date)
+            for station, value in enumerate(values)]
+
+
+def month_cells():
+    """ Two days of two provinces, given out of date order """
+    return (make_cells("Belluno", day(1, 2), ["12", "-"]) + make_cells("Padova", day(1, 2), ["30", "31"])
+            + make_cells("Belluno", day(1, 1), ["10", "11"]) + make_cells("Padova", day(1, 1), ["20", "21"]))
+
+
+def csv_rows(csv_sink):
+    return [(row['city_name'], row['date'][:10], row['station_name'], row['cell_value'])
+            for row in csv_sink.read_month(2019, 1)]
+
+
+def sqlite_rows(database_path):
+    with sqlite3.connect(database_path) as connection:
+        return sorted(connection.execute("SELECT city_name, substr(date, 1, 10), station_name, cell_value "
+                                         "FROM table_cells"))
+
+
+def test_table_cell_is_a_compact_record():
+    cell = make_cells("Belluno", day(1, 1), ["10"])[0]
+    assert not hasattr(cell, "__dict__")
+    assert list(cell.as_dict()) == TABLE_CELL_FIELDNAMES
+    assert cell.as_dict()['cell_value'] == "10"
+
+
+def test_cell_values_and_dates_are_parsed():
+    assert parse_cell_value(" 12,5 ") == (12.5, None)
+    value, text = parse_cell_value("-")
+    assert math.isnan(value) and text == "-"
+    assert math.isnan(parse_cell_value("nan")[0])
+    assert parse_date(datetime.datetime(2019, 1, 2, 10)) == datetime.date(2019, 1, 2)
+    assert parse_date("2019-01-02 00:00:00") == datetime.date(2019, 1, 2)
+
+
+def test_csv_sink_writes_sorted_months_and_replaces_the_archived_days(tmp_path):
+    csv_sink = CsvSink(str(tmp_path))
+    csv_sink.append_month(2019, 1, month_cells())
+    assert csv_sink.monthly_file_path(2019, 1) == str(tmp_path / "2019" / "1" / "2019_1_arpav_data.csv")
+    assert [date for _, date, _, _ in csv_rows(csv_sink)] == ["2019-01-01"] * 4 + ["2019-01-02"] * 4
+    # The rows of the same day keep their order
+    assert csv_rows(csv_sink)[:2] == [("Belluno", "2019-01-01", "Stazione 0", "10"),
+                                      ("Belluno", "2019-01-01", "Stazione 1", "11")]
+
+    # Appending a day again (e.g. after a crash before the manifest update) replaces it
+    csv_sink.append_month(2019, 1, make_cells("Belluno", day(1, 1), ["40", "41"]))
+    assert len(csv_rows(csv_sink)) == 8
+    assert ("Belluno", "2019-01-01", "Stazione 0", "40") in csv_rows(csv_sink)
+
+    # A day replaced by no cells (e.g. a withdrawn bulletin) is removed
+    csv_sink.replace_days(2019, 1, days={("Padova", day(1, 2))}, cells=[])
+    assert len(csv_rows(csv_sink)) == 6
+    assert ("Padova", "2019-01-02") not in {(city_name, date) for city_name, date, _, _ in csv_rows(csv_sink)}
+    assert not (tmp_path / "2019" / "1" / "2019_1_arpav_data.csv.tmp").exists()
+
+
+def test_sqlite_sink_replaces_the_archived_days(tmp_path):
+    database_path = str(tmp_path / "arpav_data.sqlite")
+    sqlite_sink = SqliteSink(database_path)
+    sqlite_sink.append_month(2019, 1, month_cells())
+    sqlite_sink.append_month(2019, 1, make_cells("Belluno", day(1, 1), ["40", "41"]))
+    sqlite_sink.replace_days(2019, 1, days={("Padova", day(1, 2))}, cells=make_cells("Padova", day(1, 2), ["50"]))
+    sqlite_sink.close()
+
+    assert sqlite_rows(database_path) == [("Belluno", "2019-01-01", "Stazione 0", "40"),
+                                          ("Belluno", "2019-01-01", "Stazione 1", "41"),
+                                          ("Belluno", "2019-01-02", "Stazione 0", "12"),
+                                          ("Belluno", "2019-01-02", "Stazione 1", "-"),
+                                          ("Padova", "2019-01-01", "Stazione 0", "20"),
+                                          ("Padova", "2019-01-01", "Stazione 1", "21"),
+                                          ("Padova", "2019-01-02", "Stazione 0", "50")]
+
+
+def test_memory_sink_keeps_or_passes_on_the_cells():
+    memory_sink = MemorySink()
+    memory_sink.append_month(2019, 1, month_cells())
+    memory_sink.replace_days(2019, 1, days={("Belluno", day(1, 1))}, cells=make_cells("Belluno", day(1, 1), ["40"]))
+    assert len(memory_sink.cells) == 7
+    assert [cell.cell_value for cell in memory_sink.cells if (cell.city_name, cell.date) == ("Belluno", day(1, 1))] \
+        == ["40"]
+
+    consumed_cells = []
+    MemorySink(consumer=consumed_cells.append).append_month(2019, 1, month_cells())
+    assert len(consumed_cells) == 8
+
+
+def test_parquet_sink_replaces_the_archived_days(tmp_path):
+    pytest.importorskip("pyarrow")
+    from arpav_parquet_sink import ParquetSink
+
+    parquet_sink = ParquetSink(str(tmp_path))
+    parquet_sink.append_month(2019, 1, month_cells())
+    parquet_sink.append_month(2019, 1, make_cells("Belluno", day(1, 1), ["40", "41"]))
+    table = parquet_sink.read_month(2019, 1)
+
+    assert table.num_rows == 8
+    assert table.column('date').to_pylist() == sorted(table.column('date').to_pylist())
+    rows = list(zip(table.column('city_name').to_pylist(), table.column('station_name').to_pylist(),
+                    table.column('cell_value').to_pylist(), table.column('cell_text').to_pylist()))
+    assert ("Belluno", "Stazione 0", 40.0, None) in rows
+    assert ("Belluno", "Stazione 1", 11.0, None) not in rows
+    assert [(city_name, station_name, text) for city_name, station_name, value, text in rows
+            if text is not None] == [("Belluno", "Stazione 1", "-")]
+
+
+def test_cells_are_streamed_in_date_order(make_scraper):
+    dates = [day(1, 30), day(1, 31), day(2, 1)]
+    cells = list(make_scraper().iter_table_cells_from_website(city_names=CITY_NAMES, dates=dates, max_workers=3))
+    days = []
+    for cell in cells:
+        if not days or days[-1] != (cell.date, cell.city_name):
+            days.append((cell.date, cell.city_name))
+    assert days == [(date, city_name) for date in dates for city_name in CITY_NAMES]